@@ -0,0 +1,120 @@
+# Headless rendering benchmark for the client. Runs GameClient's render functions
+# on SDL's dummy video driver, without a server, against synthetic game states and
+# prints frame-time percentiles per screen:
+#   python bench_render.py --players 4 --obstacles 18 --powerups 4 --frames 2000
+#   python bench_render.py --players 64   # arena size and map density as the server would pick them
+#   python bench_render.py --no-cache   # the same frames without the cached arena background
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse
+import random
+import time
+
+import pygame
+
+import game
+from match import MatchSettings
+from models import GameState
+
+SCREENS = ("game", "lobby", "game_over")
+RESYNC_FRAMES = 300  # Frames between full snapshots, like the server's RESYNC_INTERVAL at 60 fps
+
+
+def synthetic_snapshot(rng, settings, obstacles, powerups, started=True, winner=None):
+    # A game_state_update payload as the server would send it
+    colors = settings.colors
+    size = settings.arena_size
+    players = settings.max_players
+    return {
+        "matchId": 1,
+        "players": [{"id": pid, "x": rng.uniform(0, size - game.PLAYER_SIZE),
+                     "y": rng.uniform(0, size - game.PLAYER_SIZE), "speed": game.BASE_SPEED, "score": rng.randint(0, 30), "color": colors[pid - 1],
+                     "hasObject": False, "powerups": {"speedBoost": 0, "speedPenalty": 0}, "connected": True}
+                    for pid in range(1, players + 1)],
+        "sharedObject": {"x": size / 2, "y": size / 2, "isHeld": False, "holderId": None},
+        "obstacles": [{"x": rng.uniform(0, size - 60), "y": rng.uniform(0, size - 60), "size": 60, "type": "ice"}
+                      for _ in range(obstacles)],
+        "powerups": [{"id": index, "x": rng.uniform(0, size - game.POWERUP_SIZE),
+                      "y": rng.uniform(0, size - game.POWERUP_SIZE), "type": ("speed", "slow")[index % 2],
+                      "active": True} for index in range(powerups)],
+        "timeRemaining": game.GAME_DURATION,
+        "gameStarted": started,
+        "winner": winner,
+        "redStar": {"active": True, "x": 100, "y": 100, "clicksRequired": game.RED_STAR_CLICKS_REQUIRED,
+                    "clicksByPlayer": {"1": 2}, "expiresAt": time.time() + 3600},
+        "startsAt": None,
+        "arenaSize": size,
+        "maxPlayers": players,
+    }
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def bench_screen(client, screen, args, rng):
+    render = {"game": client.render_game, "lobby": client.render_lobby_screen,
+              "game_over": client.render_game_over_screen}[screen]
+    snapshot = synthetic_snapshot(rng, args.settings, args.obstacles, args.powerups,
+                                  started=screen == "game", winner=1 if screen == "game_over" else None)
+    limit = args.settings.arena_size - game.PLAYER_SIZE
+    times = []
+    for frame in range(args.warmup + args.frames):
+        # A fresh decode every RESYNC_FRAMES, like a full snapshot; player_positions-style moves in between
+        if frame % args.resync == 0:
+            client.game_state = GameState.from_dict(snapshot)
+        for player in client.game_state.players.values():
+            player.x = max(0, min(limit, player.x + rng.uniform(-5, 5)))
+            player.y = max(0, min(limit, player.y + rng.uniform(-5, 5)))
+        start = time.perf_counter()
+        render()
+        pygame.display.flip()
+        if frame >= args.warmup:
+            times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {"frames": len(times), "mean": sum(times) / len(times), "p50": percentile(times, 0.5),
+            "p90": percentile(times, 0.9), "p99": percentile(times, 0.99), "max": times[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless client rendering benchmark")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--arena-size", type=int, default=None, help="defaults to the server's size for --players")
+    parser.add_argument("--obstacles", type=int, default=None, help="defaults to the server's density")
+    parser.add_argument("--powerups", type=int, default=None, help="defaults to the server's density")
+    parser.add_argument("--frames", type=int, default=2000, help="measured frames per screen")
+    parser.add_argument("--warmup", type=int, default=100, help="frames rendered before measuring")
+    parser.add_argument("--resync", type=int, default=RESYNC_FRAMES, help="frames between full snapshots")
+    parser.add_argument("--screen", choices=SCREENS + ("all",), default="all")
+    parser.add_argument("--no-cache", action="store_true", help="redraw the arena background every frame")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    try:
+        args.settings = MatchSettings(args.players, args.arena_size)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.obstacles is None:
+        args.obstacles = args.settings.map_spec.num_obstacles
+    if args.powerups is None:
+        args.powerups = args.settings.map_spec.num_powerups
+
+    game.CACHE_BACKGROUND = not args.no_cache
+    client = game.GameClient(connect=False)
+    client.player_id = 1
+    client.connected = True
+    rng = random.Random(args.seed)
+    print(f"{pygame.display.get_driver()} driver, {args.players} players on {args.settings.arena_size}px, "
+          f"{args.obstacles} obstacles, {args.powerups} powerups, background cache {'on' if game.CACHE_BACKGROUND else 'off'}")
+    print(f"{'screen':<10} {'frames':>7} {'mean':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  (ms)")
+    try:
+        for screen in SCREENS if args.screen == "all" else (args.screen,):
+            result = bench_screen(client, screen, args, rng)
+            print(f"{screen:<10} {result['frames']:>7} {result['mean']:>8.3f} {result['p50']:>8.3f} "
+                  f"{result['p90']:>8.3f} {result['p99']:>8.3f} {result['max']:>8.3f}")
+    finally:
+        pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
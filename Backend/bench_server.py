@@ -0,0 +1,97 @@
+# Server-side benchmark for large matches. Builds a match with every slot filled,
+# no sockets involved, and times the paths that grow with arena size and player
+# count: map generation, simulation ticks (movement, swept collision, pickups and
+# the position broadcast) and finding free spots for the star and red star.
+#   python bench_server.py --players 64
+#   python bench_server.py --players 4 --ticks 2000   # the classic arena, for comparison
+import argparse
+import random
+import time
+
+from mapgen import generate_layout
+from match import Match, MatchSettings, OBJECT_SIZE, RED_STAR_SIZE, SIMULATION_STEP
+from server import GameServer
+
+INPUT_CHANGE_TICKS = 30  # Ticks a bot holds a direction before picking a new one
+
+
+def summarize(times):
+    times = sorted(times)
+    return {"count": len(times), "mean": sum(times) / len(times), "p50": times[len(times) // 2],
+            "p99": times[min(len(times) - 1, int(0.99 * len(times)))], "max": times[-1]}
+
+
+def timed_calls(func, count):
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return summarize(times)
+
+
+def bench_ticks(match, ticks, rng):
+    player_ids = list(match.game_state.players)
+    times = []
+    moved = 0
+    for tick in range(ticks):
+        if tick % INPUT_CHANGE_TICKS == 0:
+            for player_id in player_ids:
+                match.set_input(player_id, rng.randint(-1, 1), rng.randint(-1, 1))
+        before = {pid: (player.x, player.y) for pid, player in match.game_state.players.items()}
+        # Exactly one simulation step per tick, however long the last iteration took: tick() adds the time
+        # since last_tick_at on top of unsimulated
+        match.unsimulated = SIMULATION_STEP
+        match.last_tick_at = time.monotonic()
+        start = time.perf_counter()
+        match.tick()
+        times.append((time.perf_counter() - start) * 1000)
+        moved += sum(1 for pid, player in match.game_state.players.items() if before[pid] != (player.x, player.y))
+    return summarize(times), moved / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server benchmark for large arenas and player counts")
+    parser.add_argument("--players", type=int, default=64)
+    parser.add_argument("--arena-size", type=int, default=None, help="defaults to the size picked for --players")
+    parser.add_argument("--ticks", type=int, default=3000, help="simulation steps to time")
+    parser.add_argument("--maps", type=int, default=20, help="layouts to generate")
+    parser.add_argument("--spots", type=int, default=2000, help="free spot searches to time")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    try:
+        settings = MatchSettings(args.players, args.arena_size)
+    except ValueError as e:
+        parser.error(str(e))
+    rng = random.Random(args.seed)
+    spec = settings.map_spec
+    print(f"{settings.max_players} players on {settings.arena_size}px: {spec.num_obstacles} obstacles, "
+          f"{spec.num_powerups} powerups")
+
+    results = {"map generation": timed_calls(lambda: generate_layout(spec, rng.getrandbits(32)), args.maps)}
+
+    server = GameServer(history_path=None, settings=settings)
+    match = Match(1, server, settings=settings)
+    try:
+        with match.lock:
+            for player_id in range(1, settings.max_players + 1):
+                match.game_state.players[player_id] = match.new_player(player_id)
+            match.start_game()
+        results["tick"], moved = bench_ticks(match, args.ticks, rng)
+        with match.lock:
+            results["star spot"] = timed_calls(lambda: match.free_spot(OBJECT_SIZE), args.spots)
+            results["red star spot"] = timed_calls(lambda: match.free_spot(RED_STAR_SIZE, avoid_star=True), args.spots)
+    finally:
+        match.shutdown()
+
+    print(f"{'path':<16} {'count':>7} {'mean':>8} {'p50':>8} {'p99':>8} {'max':>8}  (ms)")
+    for name, result in results.items():
+        print(f"{name:<16} {result['count']:>7} {result['mean']:>8.3f} {result['p50']:>8.3f} {result['p99']:>8.3f} "
+              f"{result['max']:>8.3f}")
+    budget = SIMULATION_STEP * 1000
+    print(f"{moved:.1f} players moved per tick; p99 tick is {results['tick']['p99'] / budget:.0%} "
+          f"of the {budget:.1f} ms simulation step")
+
+
+if __name__ == "__main__":
+    main()
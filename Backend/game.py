@@ -1,13 +1,19 @@
+import time
+LAUNCHED_AT = time.perf_counter()  # Taken before the heavy imports for the time-to-first-frame report
+
+import argparse
 import pygame
 import socket
-import json
 import threading
-import time
 import sys
 from pygame.locals import *
 
+from models import GameState, SharedObject, RedStar
+from sprites import load_atlas
+from protocol import COMPRESSION_MODES, FrameDecompressor, FrameReader, decode_message, encode_frame, encode_message
+
 # Game Constants
-CANVAS_SIZE = 700
+CANVAS_SIZE = 700  # The visible part of the arena; larger arenas scroll to keep our player in view
 PLAYER_SIZE = 30
 OBJECT_SIZE = 20
 POWERUP_SIZE = 15
@@ -22,10 +28,7 @@ WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 GRAY = (80, 80, 80)
 DARK_GRAY = (40, 40, 40)
-YELLOW = (255, 215, 0)
 BLUE_ICE = (140, 190, 230)
-YELLOW_SPEED = (255, 255, 0)
-BLUE_SLOW = (30, 144, 255)
 PURPLE = (75, 0, 130)
 LIGHT_PURPLE = (100, 50, 150)
 RED = (255, 0, 0)
@@ -37,10 +40,17 @@ COLOR_MAP = {
     "green": (0, 255, 0),
     "purple": (128, 0, 128),
 }
+SCOREBOARD_SIZE = 4  # Leaders shown under the arena, plus our own line if we aren't among them
+FINAL_SCORES_SIZE = 8
+LOBBY_LIST_SIZE = 10
 
 SERVER_HOST = "localhost"
 SERVER_PORT = 5001
+COMPRESSION = COMPRESSION_MODES  # Modes offered to the server in our hello; [] to disable
+RESUME_GRACE_PERIOD = 15  # Seconds the server holds our slot after a drop; we retry for that long
+INPUT_REFRESH_INTERVAL = 0.25  # Seconds between resends of an unchanged direction, in case the server dropped one
 
+# Arrow keys always work; the slot's own scheme (wrapping round past the fourth) works too
 PLAYER_CONTROLS = [
     {"up": K_UP, "down": K_DOWN, "left": K_LEFT, "right": K_RIGHT, "name": "Arrow Keys"},
     {"up": K_w, "down": K_s, "left": K_a, "right": K_d, "name": "WASD"},
@@ -48,17 +58,38 @@ PLAYER_CONTROLS = [
     {"up": K_t, "down": K_g, "left": K_f, "right": K_h, "name": "TFGH"}
 ]
 
-# Initialize the mixer
-pygame.mixer.init()
-# Load the music
-pygame.mixer.music.load("BG_Music.mp3")
-# Set the volume
-pygame.mixer.music.set_volume(0.7)
+# Audio is only initialized if music is played; opening the audio device is slow and not every client has one
+PLAY_MUSIC = False
+MUSIC_FILE = "BG_Music.mp3"
+MUSIC_VOLUME = 0.7
+CACHE_BACKGROUND = True  # Draw the arena and obstacles once per map instead of every frame
+
+
+parsed_colors = dict(COLOR_MAP)
+
+
+def player_color(name):
+    # Slots past the fourth get "#rrggbb" colours from the server
+    color = parsed_colors.get(name)
+    if color is None:
+        try:
+            color = tuple(pygame.Color(name))[:3]
+        except (ValueError, TypeError):
+            color = (255, 0, 0)
+        parsed_colors[name] = color
+    return color
+
+
+def ranked(players):
+    return sorted(players, key=lambda player: (-player.score, player.id))
 
 
 class GameClient:
-    def __init__(self):
-        pygame.init()
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, spectate=False, match_id=None, name=None, connect=True):
+        self.startup = {}  # Phase name: milliseconds, reported with the first frame
+        phase_start = time.perf_counter()
+        # Only the modules we use; pygame.init() would also open the mixer
+        pygame.display.init()
         pygame.font.init()
         self.screen = pygame.display.set_mode((CANVAS_SIZE, CANVAS_SIZE + 100))
         pygame.display.set_caption("Multiplayer Game")
@@ -67,97 +98,70 @@ class GameClient:
         self.font_large = pygame.font.SysFont('Arial', 24)
         self.font_medium = pygame.font.SysFont('Arial', 20)
         self.font_small = pygame.font.SysFont('Arial', 16)
+        self.startup["display"] = (time.perf_counter() - phase_start) * 1000
 
         # Initialize game state with default values
-        self.game_state = {
-            "players": [],
-            "sharedObject": {"x": CANVAS_SIZE / 2 - OBJECT_SIZE / 2, "y": CANVAS_SIZE / 2 - OBJECT_SIZE / 2,
-                             "isHeld": False, "holderId": None},
-            "obstacles": [],
-            "powerups": [],
-            "timeRemaining": GAME_DURATION,
-            "gameStarted": False,
-            "winner": None,
-            "redStar": {
-                "active": False,
-                "x": 0,
-                "y": 0,
-                "clicksRequired": RED_STAR_CLICKS_REQUIRED,
-                "clicksByPlayer": {},
-                "expiresAt": 0
-            }
-        }
+        self.game_state = GameState(
+            SharedObject(CANVAS_SIZE / 2 - OBJECT_SIZE / 2, CANVAS_SIZE / 2 - OBJECT_SIZE / 2),
+            RedStar(RED_STAR_CLICKS_REQUIRED),
+            GAME_DURATION
+        )
         self.player_id = None
         self.connected = False
         self.connection_error = None
         self.game_ended = False
-
+        self.queue_position = None  # Set while the server's matchmaker has us waiting for a slot
+        self.resume_token = None  # Lets us rejoin our match after a network drop
+        self.reconnecting = False
+        self.last_input = None  # (dx, dy) last sent to the server
+        self.last_input_at = 0.0
+        self.last_tick = None  # Server tick of the newest update we have; the server judges our actions by it
+        self.rtt = None  # Smoothed round-trip time reported by the server, in seconds
+        self.clock_offset = 0.0  # Our clock minus the server's; applied to every server timestamp
+        # Spectators (directly or through relay.py) watch a match without taking a slot
+        self.spectate = spectate
+        self.spectate_match = match_id
+        self.spectating = False
+
+        self.host = host
+        self.port = port
+        self.name = name  # Sent in the hello; the server keeps match history and the leaderboard by name
         self.socket = None
+        self.decompressor = None
         self.receive_thread = None
         self.running = True
-
-        self.star_icon = self.create_star_icon()
-        self.speed_icon = self.create_speed_icon()
-        self.slow_icon = self.create_slow_icon()
-        self.red_star_icon = self.create_red_star_icon()
-
-        self.connect_to_server()
-
-    def create_star_icon(self):
-        icon = pygame.Surface((OBJECT_SIZE, OBJECT_SIZE), pygame.SRCALPHA)
-        pygame.draw.polygon(icon, YELLOW, [
-            (OBJECT_SIZE / 2, 0), (OBJECT_SIZE * 0.65, OBJECT_SIZE * 0.35), (OBJECT_SIZE, OBJECT_SIZE * 0.4),
-            (OBJECT_SIZE * 0.75, OBJECT_SIZE * 0.65), (OBJECT_SIZE * 0.8, OBJECT_SIZE),
-            (OBJECT_SIZE / 2, OBJECT_SIZE * 0.85), (OBJECT_SIZE * 0.2, OBJECT_SIZE),
-            (OBJECT_SIZE * 0.25, OBJECT_SIZE * 0.65), (0, OBJECT_SIZE * 0.4), (OBJECT_SIZE * 0.35, OBJECT_SIZE * 0.35)
-        ])
-        return icon
-
-    def create_red_star_icon(self):
-        icon = pygame.Surface((RED_STAR_SIZE, RED_STAR_SIZE), pygame.SRCALPHA)
-        pygame.draw.polygon(icon, RED, [
-            (RED_STAR_SIZE / 2, 0), (RED_STAR_SIZE * 0.65, RED_STAR_SIZE * 0.35), (RED_STAR_SIZE, RED_STAR_SIZE * 0.4),
-            (RED_STAR_SIZE * 0.75, RED_STAR_SIZE * 0.65), (RED_STAR_SIZE * 0.8, RED_STAR_SIZE),
-            (RED_STAR_SIZE / 2, RED_STAR_SIZE * 0.85), (RED_STAR_SIZE * 0.2, RED_STAR_SIZE),
-            (RED_STAR_SIZE * 0.25, RED_STAR_SIZE * 0.65), (0, RED_STAR_SIZE * 0.4),
-            (RED_STAR_SIZE * 0.35, RED_STAR_SIZE * 0.35)
-        ])
-        # Add a glowing effect (pulsating outline)
-        pygame.draw.polygon(icon, BRIGHT_RED, [
-            (RED_STAR_SIZE / 2, 0), (RED_STAR_SIZE * 0.65, RED_STAR_SIZE * 0.35), (RED_STAR_SIZE, RED_STAR_SIZE * 0.4),
-            (RED_STAR_SIZE * 0.75, RED_STAR_SIZE * 0.65), (RED_STAR_SIZE * 0.8, RED_STAR_SIZE),
-            (RED_STAR_SIZE / 2, RED_STAR_SIZE * 0.85), (RED_STAR_SIZE * 0.2, RED_STAR_SIZE),
-            (RED_STAR_SIZE * 0.25, RED_STAR_SIZE * 0.65), (0, RED_STAR_SIZE * 0.4),
-            (RED_STAR_SIZE * 0.35, RED_STAR_SIZE * 0.35)
-        ], 2)
-        return icon
-
-    def create_speed_icon(self):
-        icon = pygame.Surface((POWERUP_SIZE, POWERUP_SIZE), pygame.SRCALPHA)
-        pygame.draw.polygon(icon, YELLOW_SPEED, [
-            (POWERUP_SIZE / 2, 0), (POWERUP_SIZE * 0.25, POWERUP_SIZE * 0.5), (POWERUP_SIZE * 0.6, POWERUP_SIZE * 0.5),
-            (POWERUP_SIZE * 0.4, POWERUP_SIZE), (POWERUP_SIZE * 0.75, POWERUP_SIZE * 0.5),
-            (POWERUP_SIZE * 0.4, POWERUP_SIZE * 0.5), (POWERUP_SIZE * 0.6, 0)
-        ])
-        return icon
-
-    def create_slow_icon(self):
-        icon = pygame.Surface((POWERUP_SIZE, POWERUP_SIZE), pygame.SRCALPHA)
-        pygame.draw.circle(icon, BLUE_SLOW, (POWERUP_SIZE // 2, POWERUP_SIZE // 2), POWERUP_SIZE // 2)
-        pygame.draw.line(icon, WHITE, (POWERUP_SIZE // 2, 2), (POWERUP_SIZE // 2, POWERUP_SIZE - 2), 2)
-        pygame.draw.line(icon, WHITE, (2, POWERUP_SIZE // 2), (POWERUP_SIZE - 2, POWERUP_SIZE // 2), 2)
-        pygame.draw.line(icon, WHITE, (POWERUP_SIZE * 0.25, POWERUP_SIZE * 0.25),
-                         (POWERUP_SIZE * 0.75, POWERUP_SIZE * 0.75), 2)
-        pygame.draw.line(icon, WHITE, (POWERUP_SIZE * 0.25, POWERUP_SIZE * 0.75),
-                         (POWERUP_SIZE * 0.75, POWERUP_SIZE * 0.25), 2)
-        return icon
+        self.audio_ready = False
+        self.first_frame_at = None
+
+        sprites, atlas = load_atlas({"star": OBJECT_SIZE, "red_star": RED_STAR_SIZE, "speed": POWERUP_SIZE,
+                                     "slow": POWERUP_SIZE})
+        self.startup[f"sprites ({atlas['source']})"] = atlas["ms"]
+        self.star_icon = sprites["star"]
+        self.speed_icon = sprites["speed"]
+        self.slow_icon = sprites["slow"]
+        self.red_star_icon = sprites["red_star"]
+        self.background = None
+        self.background_obstacles = None  # Obstacle list the cached background was drawn from
+        self.camera = (0, 0)  # Arena position of the view's top-left corner
+
+        # bench_render.py drives the renderer without a server
+        if not connect:
+            return
+        # Connect in the background so the first frame doesn't wait on the network
+        connect_thread = threading.Thread(target=self.connect_to_server)
+        connect_thread.daemon = True
+        connect_thread.start()
 
     # Connect to the game server
     def connect_to_server(self):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((SERVER_HOST, SERVER_PORT))
+            self.socket.connect((self.host, self.port))
             self.connected = True
+            if self.spectate:
+                self.send_message({"type": "hello", "role": "spectator", "matchId": self.spectate_match})
+            else:
+                self.send_message({"type": "hello", "compression": COMPRESSION, "name": self.name})
             self.receive_thread = threading.Thread(target=self.receive_messages)
             self.receive_thread.daemon = True
             self.receive_thread.start()
@@ -168,53 +172,92 @@ class GameClient:
 
     def receive_messages(self):
         # Continously recieve messages while client is connected
-        try:
-        
-            while self.running:
-                # First, recieve the 4-byte message header
-                header = self.recvall(4)
-                # If header is None, the connection is closed
-                if not header:
-                    break
-                # Convert the header to integer to get the message length
-                message_length = int.from_bytes(header, byteorder='big')
-                # Recieve the message data
-                data = self.recvall(message_length)
-                if not data:
-                    break
-                # Decode the data and parse the JSON message
-                message = json.loads(data.decode('utf-8'))
-                # Handle the server message
-                self.handle_server_message(message)
-        except Exception as e:
-            self.connected = False
-            print(f"Connection lost: {e}")
-        finally:
+        while self.running:
+            try:
+                # Each payload is a view into the reader's buffer, valid until the next frame
+                for payload in FrameReader(self.socket).frames():
+                    if not self.running:
+                        break
+                    # Everything after connection_accepted may be compressed
+                    if self.decompressor:
+                        payload = self.decompressor.decompress(payload)
+                    # Decode the data and parse the JSON message
+                    message = decode_message(payload)
+                    # Handle the server message
+                    self.handle_server_message(message)
+                print("Connection closed by server")
+            except Exception as e:
+                print(f"Connection lost: {e}")
             if self.socket:
                 self.socket.close()
             self.socket = None
+            # With a resume token the server is holding our slot, so try to get it back
+            if not self.running or not self.resume_token or not self.reconnect():
+                break
+        self.connected = False
 
-    def recvall(self, n):
-        data = b''
-        while len(data) < n:
-            packet = self.socket.recv(n - len(data))
-            if not packet:
-                return None
-            data += packet
-        return data
+    def reconnect(self):
+        self.reconnecting = True
+        self.decompressor = None
+        deadline = time.time() + RESUME_GRACE_PERIOD
+        delay = 0.1
+        while self.running and time.time() < deadline:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=2)
+                sock.settimeout(None)
+                # The server answers with a resumed catch-up snapshot instead of a new admission. If the
+                # token has expired it queues us as a new player, so the name goes along as on first connect.
+                sock.sendall(encode_frame(encode_message({"type": "hello", "compression": COMPRESSION,
+                                                          "name": self.name, "resumeToken": self.resume_token})))
+                self.socket = sock
+                print("Reconnected, resuming session")
+                return True
+            except OSError as e:
+                print(f"Reconnect failed: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+        self.reconnecting = False
+        return False
 
     # Handle messages from the server
     def handle_server_message(self, message):
         # Get the type of message
         msg_type = message.get("type")
-        if msg_type == "connection_accepted":
-            # Connection accepted, get player ID and game state
+        if message.get("tick") is not None:
+            self.last_tick = message.get("tick")
+        if msg_type in ("connection_accepted", "resumed"):
+            # Connection accepted (or our session resumed), get player ID and game state
             self.player_id = message.get("playerId")
+            self.resume_token = message.get("resumeToken")
+            self.reconnecting = False
+            # The server forgets held keys when a connection drops; send ours again
+            self.last_input = None
             new_game_state = message.get("gameState")
             # Update the game state if provided
             if new_game_state:
-                self.game_state.update(new_game_state)
-            print(f"Connected as Player {self.player_id}")
+                self.game_state = GameState.from_dict(new_game_state)
+            self.queue_position = None
+            # The server compresses every frame after this one if it picked a mode
+            mode = message.get("compression")
+            if mode:
+                self.decompressor = FrameDecompressor(mode)
+            print(f"{'Resumed' if msg_type == 'resumed' else 'Connected'} as Player {self.player_id} "
+                  f"in match {message.get('matchId')} (compression: {mode})")
+        # Answer right away so the server measures the round trip, not our frame time
+        elif msg_type == "ping":
+            self.send_message({"type": "pong", "seq": message.get("seq"), "serverTime": message.get("serverTime"),
+                               "clientTime": time.time()})
+            self.rtt = message.get("rtt")
+            if message.get("clockOffset") is not None:
+                self.clock_offset = message.get("clockOffset")
+        # Watching a match; snapshots follow uncompressed
+        elif msg_type == "spectate_accepted":
+            self.spectating = True
+            print(f"Spectating match {message.get('matchId')}{' through a relay' if message.get('relay') else ''}")
+        # Still waiting in the matchmaking queue
+        elif msg_type == "queue_status":
+            self.queue_position = message.get("position")
+            print(f"Queue position {self.queue_position}/{message.get('queueLength')}")
         # If connection is rejected, set the error message
         elif msg_type == "connection_rejected":
             self.connection_error = message.get("message")
@@ -224,41 +267,104 @@ class GameClient:
             # Update the game state with the new data
             new_game_state = message.get("gameState")
             if new_game_state:
-                
-                self.game_state.update(new_game_state)
+                # Swap in a freshly decoded state so the render loop never sees a half-applied update
+                game_state = GameState.from_dict(new_game_state)
+                # Area-of-interest views only carry the map the first time; it stays the same all round
+                if "obstacles" not in new_game_state:
+                    game_state.obstacles = self.game_state.obstacles
+                self.game_state = game_state
                 # Check if the game just ended
-                if not self.game_state.get("gameStarted", False) and self.game_state.get("winner") is not None:
+                if not self.game_state.game_started and self.game_state.winner is not None:
                     self.game_ended = True
+                # The matchmaker starts the next round with the same players
+                elif self.game_state.game_started:
+                    self.game_ended = False
             print(
-                f"Received game state update for Player {self.player_id}: gameStarted={self.game_state.get('gameStarted', False)}")
+                f"Received game state update for Player {self.player_id}: gameStarted={self.game_state.game_started}")
             # If the game is over, set the game_ended flag
-            for player in self.game_state.get("players", []):
-                if player["id"] == self.player_id:
-                    print(f"Player {self.player_id} position: ({player['x']}, {player['y']})")
+            player = self.game_state.players.get(self.player_id)
+            if player:
+                print(f"Player {self.player_id} position: ({player.x}, {player.y})")
+        # Events between snapshots, applied to the state we already have
+        elif msg_type == "player_positions":
+            players = self.game_state.players
+            for player_id, x, y in message.get("players", []):
+                player = players.get(player_id)
+                if player:
+                    player.x, player.y = x, y
+        elif msg_type == "tick_time":
+            self.game_state.time_remaining = message.get("timeRemaining", 0)
+        elif msg_type == "red_star_progress":
+            red_star = self.game_state.red_star
+            if message.get("collected"):
+                red_star.active = False
+                red_star.clicks_by_player = {}
+            else:
+                red_star.clicks_by_player[message.get("playerId")] = message.get("clicks", 0)
+            self.set_score(message.get("playerId"), message.get("score"))
+        elif msg_type == "star_collected":
+            self.set_score(message.get("playerId"), message.get("score"))
+            # With area of interest on, no position means the star moved out of our view; if we weren't
+            # tracking it, the next view brings it in
+            shared_object = self.game_state.shared_object
+            if "x" not in message:
+                self.game_state.shared_object = None
+            elif shared_object:
+                shared_object.x, shared_object.y = message.get("x"), message.get("y")
+        elif msg_type == "powerup_taken":
+            for powerup in self.game_state.powerups:
+                if powerup.id == message.get("id"):
+                    powerup.active = False
+            player = self.game_state.players.get(message.get("playerId"))
+            if player:
+                player.speed_boost = message.get("speedBoost", player.speed_boost)
+                player.speed_penalty = message.get("speedPenalty", player.speed_penalty)
+        # Entities crossing our area-of-interest boundary, and players moving inside it
+        elif msg_type == "interest_update":
+            game_state = self.game_state
+            for entity in message.get("leave", []):
+                game_state.remove_entity(entity["kind"], entity["id"])
+            for entity in message.get("enter", []):
+                game_state.add_entity(entity["kind"], entity["data"])
+            for player_id, x, y in message.get("players", []):
+                player = game_state.players.get(player_id)
+                if player:
+                    player.x, player.y = x, y
+
+    def set_score(self, player_id, score):
+        player = self.game_state.players.get(player_id)
+        if player and score is not None:
+            player.score = score
 
     def send_message(self, message):
         try:
-            if not self.connected or not self.socket:
+            if not self.connected or not self.socket or self.reconnecting:
                 return
-            data = json.dumps(message).encode('utf-8')
-            length = len(data).to_bytes(4, byteorder='big')
-            self.socket.sendall(length + data)
+            self.socket.sendall(encode_frame(encode_message(message)))
             print(f"Sent message: {message}")
         except Exception as e:
             print(f"Error sending message: {e}")
-            self.connected = False
-
-    def move_player(self, direction):
-        if not self.connected or not self.player_id or not self.game_state or not self.game_state.get("gameStarted"):
-            print(
-                f"Cannot move: connected={self.connected}, player_id={self.player_id}, game_started={self.game_state.get('gameStarted') if self.game_state else False}")
+            # The receive thread notices the drop too and resumes the session if it can
+            if not self.resume_token:
+                self.connected = False
+
+    def send_input(self, dx, dy):
+        # Direction changes go out straight away; the server keeps moving us while a key is held. The
+        # current direction is repeated every INPUT_REFRESH_INTERVAL, so a stop the rate limiter dropped
+        # can't leave us running.
+        if not self.connected or not self.player_id:
+            return
+        now = time.monotonic()
+        if (dx, dy) == self.last_input and now - self.last_input_at < INPUT_REFRESH_INTERVAL:
             return
-        self.send_message({"type": "move", "direction": direction, "playerId": self.player_id})
+        self.last_input = (dx, dy)
+        self.last_input_at = now
+        self.send_message({"type": "input", "dx": dx, "dy": dy, "tick": self.last_tick})
 
     def click_red_star(self):
-        if not self.connected or not self.player_id or not self.game_state or not self.game_state.get("gameStarted"):
+        if not self.connected or not self.player_id or not self.game_state.game_started:
             return
-        self.send_message({"type": "click_red_star", "playerId": self.player_id})
+        self.send_message({"type": "click_red_star", "playerId": self.player_id, "tick": self.last_tick})
 
     def start_game(self):
         if not self.connected or not self.is_player_one():
@@ -277,41 +383,39 @@ class GameClient:
                 mouse_pos = pygame.mouse.get_pos()
 
                 # Start game button in lobby
-                if self.game_state and not self.game_state.get(
-                        "gameStarted") and not self.game_ended and self.is_player_one():
+                if not self.game_state.game_started and not self.game_ended and self.is_player_one():
                     start_button_rect = pygame.Rect(CANVAS_SIZE // 2 - 80, CANVAS_SIZE + 50, 160, 40)
                     if start_button_rect.collidepoint(mouse_pos):
                         self.start_game()
 
                 # Check if the red star was clicked
-                if self.game_state and self.game_state.get("gameStarted") and self.player_id is not None:
-                    red_star = self.game_state.get("redStar", {})
-                    if red_star.get("active", False):
+                if self.game_state.game_started and self.player_id is not None:
+                    red_star = self.game_state.red_star
+                    if red_star.active:
                         # Get the player object
-                        player = next((p for p in self.game_state.get("players", []) if p["id"] == self.player_id),
-                                      None)
+                        player = self.game_state.players.get(self.player_id)
                         if player:
                             # Check if mouse is over red star
-                            red_star_rect = pygame.Rect(red_star["x"], red_star["y"], RED_STAR_SIZE, RED_STAR_SIZE)
+                            red_star_rect = pygame.Rect(red_star.x - self.camera[0], red_star.y - self.camera[1],
+                                                        RED_STAR_SIZE, RED_STAR_SIZE)
                             if red_star_rect.collidepoint(mouse_pos):
                                 # Send the click to the server - removed the player collision check
                                 self.click_red_star()
                                 print(f"Player {self.player_id} clicked red star!")
 
-        if self.game_state and self.game_state.get("gameStarted") and self.player_id is not None:
+        # Tracked in the lobby too, so a key held when the round starts moves us straight away
+        if self.player_id is not None:
             keys = pygame.key.get_pressed()
-            control_idx = self.player_id - 1 if self.player_id - 1 < len(PLAYER_CONTROLS) else 0
-            controls = PLAYER_CONTROLS[control_idx]
-            if keys[controls["up"]]:
-                self.move_player("up")
-            if keys[controls["down"]]:
-                self.move_player("down")
-            if keys[controls["left"]]:
-                self.move_player("left")
-            if keys[controls["right"]]:
-                self.move_player("right")
+            schemes = (PLAYER_CONTROLS[0], PLAYER_CONTROLS[(self.player_id - 1) % len(PLAYER_CONTROLS)])
+            dx = int(any(keys[c["right"]] for c in schemes)) - int(any(keys[c["left"]] for c in schemes))
+            dy = int(any(keys[c["down"]] for c in schemes)) - int(any(keys[c["up"]] for c in schemes))
+            self.send_input(dx, dy)
 
 
+    def server_time(self):
+        # Now on the server's clock, for comparing against the timestamps it sends
+        return time.time() - self.clock_offset
+
     def is_player_one(self):
         return self.player_id == 1
 
@@ -322,25 +426,47 @@ class GameClient:
             self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, CANVAS_SIZE // 2 - 40))
             text = self.font_medium.render(self.connection_error, True, WHITE)
             self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, CANVAS_SIZE // 2))
+        elif self.queue_position is not None:
+            text = self.font_large.render("Waiting for a match...", True, WHITE)
+            self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, CANVAS_SIZE // 2 - 40))
+            text = self.font_medium.render(f"Position in queue: {self.queue_position}", True, WHITE)
+            self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, CANVAS_SIZE // 2))
         else:
             text = self.font_large.render("Connecting to server...", True, WHITE)
             self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, CANVAS_SIZE // 2))
 
+    def render_start_countdown(self):
+        # The matchmaker starts full or busy-enough lobbies on its own
+        starts_at = self.game_state.starts_at
+        if starts_at is None:
+            return False
+        seconds = max(0, int(starts_at - self.server_time()) + 1)
+        text = self.font_medium.render(f"Next round starts in {seconds}s", True, WHITE)
+        self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, CANVAS_SIZE + 15))
+        return True
+
     # Render the game lobby screen while waiting for players
     def render_lobby_screen(self):
         self.screen.fill(DARK_GRAY)
         text = self.font_large.render("Game Lobby", True, WHITE)
         self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, 50))
-        text = self.font_medium.render(f"Your ID: {self.player_id}", True, WHITE)
+        label = "Spectating" if self.spectating else f"Your ID: {self.player_id}"
+        text = self.font_medium.render(label, True, WHITE)
         self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, 80))
 
-        text = self.font_medium.render("Connected Players:", True, WHITE)
+        players = list(self.game_state.players.values())
+        max_players = self.game_state.max_players or MAX_PLAYERS
+        text = self.font_medium.render(f"Connected Players ({len(players)}/{max_players}):", True, WHITE)
         self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, 120))
         y_pos = 160
-        for player in self.game_state.get("players", []):
-            player_color = COLOR_MAP.get(player.get("color", "red"), (255, 0, 0))
-            text = self.font_medium.render(f"Player {player['id']}{' (You)' if player['id'] == self.player_id else ''}",
-                                           True, player_color)
+        for player in players[:LOBBY_LIST_SIZE]:
+            color = player_color(player.color)
+            text = self.font_medium.render(f"Player {player.id}{' (You)' if player.id == self.player_id else ''}",
+                                           True, color)
+            self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, y_pos))
+            y_pos += 30
+        if len(players) > LOBBY_LIST_SIZE:
+            text = self.font_medium.render(f"... and {len(players) - LOBBY_LIST_SIZE} more", True, WHITE)
             self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, y_pos))
             y_pos += 30
 
@@ -364,16 +490,17 @@ class GameClient:
             start_text = self.font_medium.render("Start Game", True, WHITE)
             self.screen.blit(start_text, (
                 button_rect.centerx - start_text.get_width() // 2, button_rect.centery - start_text.get_height() // 2))
-        else:
-            wait_text = self.font_medium.render("Waiting for Player 1...", True, WHITE)
+            self.render_start_countdown()
+        elif not self.render_start_countdown():
+            wait_text = self.font_medium.render("Waiting for more players...", True, WHITE)
             self.screen.blit(wait_text, (CANVAS_SIZE // 2 - wait_text.get_width() // 2, CANVAS_SIZE + 60))
 
     def render_game_over_screen(self):
         self.screen.fill(DARK_GRAY)
 
         # Display winner
-        winner = self.game_state.get("winner")
-        winner_player = next((p for p in self.game_state.get("players", []) if p["id"] == winner), None)
+        winner = self.game_state.winner
+        winner_player = self.game_state.players.get(winner)
 
         # Game over title
         text = self.font_large.render("GAME OVER", True, WHITE)
@@ -381,7 +508,7 @@ class GameClient:
 
         # Winner information
         if winner_player:
-            winner_color = COLOR_MAP.get(winner_player.get("color", "red"), (255, 0, 0))
+            winner_color = player_color(winner_player.color)
             winner_text = self.font_large.render(f"Player {winner} Wins!", True, winner_color)
             you_text = ""
             if winner == self.player_id:
@@ -397,103 +524,201 @@ class GameClient:
         self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, CANVAS_SIZE // 2))
 
         y_pos = CANVAS_SIZE // 2 + 30
-        for player in sorted(self.game_state.get("players", []), key=lambda p: p.get("score", 0), reverse=True):
-            player_color = COLOR_MAP.get(player.get("color", "red"), (255, 0, 0))
+        for rank, player in self.leaders(FINAL_SCORES_SIZE):
+            color = player_color(player.color)
             score_text = self.font_medium.render(
-                f"Player {player['id']}: {player['score']} points{' (You)' if player['id'] == self.player_id else ''}",
+                f"{rank}. Player {player.id}: {player.score} points{' (You)' if player.id == self.player_id else ''}",
                 True,
-                player_color
+                color
             )
             self.screen.blit(score_text, (CANVAS_SIZE // 2 - score_text.get_width() // 2, y_pos))
             y_pos += 30
 
         # Informational text for all players
         info_text = self.font_medium.render("Game session ended", True, WHITE)
-        self.screen.blit(info_text, (CANVAS_SIZE // 2 - info_text.get_width() // 2, CANVAS_SIZE // 2 + 90))
+        self.screen.blit(info_text, (CANVAS_SIZE // 2 - info_text.get_width() // 2, y_pos + 10))
+        self.render_start_countdown()
 
     def render_game(self):
-        self.screen.fill(DARK_GRAY)
-        pygame.draw.rect(self.screen, GRAY, (0, 0, CANVAS_SIZE, CANVAS_SIZE))
-
-        for obstacle in self.game_state.get("obstacles", []):
-            pygame.draw.rect(self.screen, BLUE_ICE, (obstacle["x"], obstacle["y"], obstacle["size"], obstacle["size"]))
+        # Render from one state object even if the receive thread swaps in a new one mid-frame
+        game_state = self.game_state
+        arena_size = game_state.arena_size or CANVAS_SIZE
+        cam_x, cam_y = self.camera = self.follow(game_state, arena_size)
+        if CACHE_BACKGROUND:
+            if arena_size < CANVAS_SIZE:
+                self.screen.fill(DARK_GRAY)
+            self.screen.blit(self.arena_background(game_state.obstacles, arena_size), (0, 0),
+                             (cam_x, cam_y, CANVAS_SIZE, CANVAS_SIZE))
+        else:
+            self.draw_arena(self.screen, game_state.obstacles, arena_size, self.camera)
 
-        for powerup in self.game_state.get("powerups", []):
-            if powerup.get("active", False):
-                if powerup["type"] == "speed":
-                    self.screen.blit(self.speed_icon, (powerup["x"], powerup["y"]))
-                elif powerup["type"] == "slow":
-                    self.screen.blit(self.slow_icon, (powerup["x"], powerup["y"]))
+        for powerup in game_state.powerups:
+            if powerup.active and self.in_view(powerup.x, powerup.y, POWERUP_SIZE):
+                if powerup.type == "speed":
+                    self.screen.blit(self.speed_icon, (powerup.x - cam_x, powerup.y - cam_y))
+                elif powerup.type == "slow":
+                    self.screen.blit(self.slow_icon, (powerup.x - cam_x, powerup.y - cam_y))
 
-        shared_obj = self.game_state.get("sharedObject", {})
-        self.screen.blit(self.star_icon, (shared_obj.get("x", 0), shared_obj.get("y", 0)))
+        # The star is None while it is outside our area of interest
+        shared_obj = game_state.shared_object
+        if shared_obj:
+            self.screen.blit(self.star_icon, (shared_obj.x - cam_x, shared_obj.y - cam_y))
 
         # Render red star if active
-        red_star = self.game_state.get("redStar", {})
-        if red_star.get("active", False):
-            self.screen.blit(self.red_star_icon, (red_star.get("x", 0), red_star.get("y", 0)))
+        red_star = game_state.red_star
+        if red_star.active:
+            self.screen.blit(self.red_star_icon, (red_star.x - cam_x, red_star.y - cam_y))
 
             # Draw progress indicator for the current player
-            current_player_clicks = red_star.get("clicksByPlayer", {}).get(str(self.player_id), 0)
+            current_player_clicks = red_star.clicks_by_player.get(self.player_id, 0)
             if current_player_clicks > 0:
                 progress_text = self.font_small.render(f"{current_player_clicks}/{RED_STAR_CLICKS_REQUIRED}", True,
                                                        WHITE)
-                self.screen.blit(progress_text, (red_star.get("x", 0), red_star.get("y", 0) - 20))
-
-        for player in self.game_state.get("players", []):
-            player_color = COLOR_MAP.get(player.get("color", "red"), (255, 0, 0))
-            player_rect = pygame.Rect(player["x"], player["y"], PLAYER_SIZE, PLAYER_SIZE)
-            pygame.draw.rect(self.screen, player_color, player_rect)
-            if player["id"] == self.player_id:
+                self.screen.blit(progress_text, (red_star.x - cam_x, red_star.y - cam_y - 20))
+
+        for player in game_state.players.values():
+            if not self.in_view(player.x, player.y, PLAYER_SIZE):
+                continue
+            color = player_color(player.color)
+            player_rect = pygame.Rect(player.x - cam_x, player.y - cam_y, PLAYER_SIZE, PLAYER_SIZE)
+            pygame.draw.rect(self.screen, color, player_rect)
+            # Players who dropped keep their slot while the server waits for them to resume
+            if not player.connected:
+                pygame.draw.rect(self.screen, DARK_GRAY, player_rect, 4)
+            if player.id == self.player_id:
                 pygame.draw.rect(self.screen, WHITE, player_rect, 2)
 
         pygame.draw.rect(self.screen, DARK_GRAY, (0, CANVAS_SIZE, CANVAS_SIZE, 100))
-        time_text = self.font_large.render(f"Time: {self.game_state.get('timeRemaining', 0)}s", True, WHITE)
+        time_text = self.font_large.render(f"Time: {game_state.time_remaining}s", True, WHITE)
         self.screen.blit(time_text, (20, CANVAS_SIZE + 10))
+        if self.rtt is not None:
+            rtt_text = self.font_small.render(f"RTT: {self.rtt * 1000:.0f} ms", True, WHITE)
+            self.screen.blit(rtt_text, (CANVAS_SIZE - rtt_text.get_width() - 20, CANVAS_SIZE + 10))
 
+        # Leaders side by side, as many as fit beside the red star status
         score_x = 20
-        for player in self.game_state.get("players", []):
-            player_color = COLOR_MAP.get(player.get("color", "red"), (255, 0, 0))
-            score_text = self.font_medium.render(
-                f"P{player['id']}: {player['score']}{' (You)' if player['id'] == self.player_id else ''}", True,
-                player_color
-            )
+        score_limit = CANVAS_SIZE - 160 if red_star.active else CANVAS_SIZE - 20
+        for rank, player in self.leaders(SCOREBOARD_SIZE):
+            label = f"{rank}. P{player.id}: {player.score}{' (You)' if player.id == self.player_id else ''}"
+            score_text = self.font_medium.render(label, True, player_color(player.color))
+            if score_x + score_text.get_width() > score_limit:
+                break
             self.screen.blit(score_text, (score_x, CANVAS_SIZE + 40))
-            score_x += 150
+            score_x += score_text.get_width() + 25
 
         # Display red star status if active
-        if red_star.get("active", False):
-            time_left = max(0, red_star.get("expiresAt", 0) - time.time())
+        if red_star.active:
+            time_left = max(0, red_star.expires_at - self.server_time())
             red_star_text = self.font_medium.render(f"RED STAR! {time_left:.1f}s", True, RED)
             self.screen.blit(red_star_text, (CANVAS_SIZE - 150, CANVAS_SIZE + 40))
 
+    def leaders(self, count):
+        # (rank, player) of the top count players, with our own line added if we are further down
+        standings = list(enumerate(ranked(self.game_state.players.values()), 1))
+        shown = standings[:count]
+        shown += [(rank, player) for rank, player in standings[count:] if player.id == self.player_id]
+        return shown
+
+    def follow(self, game_state, arena_size):
+        # Camera position: centred on our player (the leader when spectating), clamped to the arena
+        player = game_state.players.get(self.player_id)
+        if player is None and game_state.players:
+            player = ranked(game_state.players.values())[0]
+        if player is None or arena_size <= CANVAS_SIZE:
+            return 0, 0
+        limit = arena_size - CANVAS_SIZE
+        return (int(max(0, min(limit, player.x + PLAYER_SIZE / 2 - CANVAS_SIZE / 2))),
+                int(max(0, min(limit, player.y + PLAYER_SIZE / 2 - CANVAS_SIZE / 2))))
+
+    def in_view(self, x, y, size):
+        cam_x, cam_y = self.camera
+        return cam_x - size < x < cam_x + CANVAS_SIZE and cam_y - size < y < cam_y + CANVAS_SIZE
+
+    def draw_arena(self, surface, obstacles, arena_size, camera=(0, 0)):
+        cam_x, cam_y = camera
+        surface.fill(DARK_GRAY)
+        pygame.draw.rect(surface, GRAY, (-cam_x, -cam_y, arena_size, arena_size))
+        for obstacle in obstacles:
+            pygame.draw.rect(surface, BLUE_ICE, (obstacle.x - cam_x, obstacle.y - cam_y, obstacle.size, obstacle.size))
+
+    def arena_background(self, obstacles, arena_size):
+        # The whole arena, drawn once; obstacles only change with a new snapshot, which always brings a new list
+        if self.background is None or self.background.get_width() != arena_size:
+            self.background = pygame.Surface((arena_size, arena_size)).convert()
+            self.background_obstacles = None
+        if obstacles is not self.background_obstacles:
+            self.draw_arena(self.background, obstacles, arena_size)
+            self.background_obstacles = obstacles
+        return self.background
+
+    def render_reconnecting_banner(self):
+        text = self.font_large.render("Connection lost - reconnecting...", True, BRIGHT_RED)
+        self.screen.blit(text, (CANVAS_SIZE // 2 - text.get_width() // 2, CANVAS_SIZE // 2))
+
+    def start_music(self):
+        # First use initializes the mixer and loads the track
+        if not self.audio_ready:
+            try:
+                pygame.mixer.init()
+                pygame.mixer.music.load(MUSIC_FILE)
+                pygame.mixer.music.set_volume(MUSIC_VOLUME)
+                self.audio_ready = True
+            except Exception as e:
+                print(f"Music disabled: {e}")
+                return
+        pygame.mixer.music.play(-1)  # -1 means loop indefinitely
+
+    def report_first_frame(self):
+        self.first_frame_at = time.perf_counter()
+        phases = ", ".join(f"{name} {ms:.1f} ms" for name, ms in self.startup.items())
+        print(f"First frame {(self.first_frame_at - LAUNCHED_AT) * 1000:.1f} ms after launch ({phases})")
+
     def run(self):
-        # Start the music
-        #pygame.mixer.music.play(-1)  # -1 means loop indefinitely
+        if PLAY_MUSIC:
+            self.start_music()
 
         while self.running:
             self.handle_input()
-            if not self.connected:
+            if not self.connected or (self.player_id is None and not self.spectating):
                 self.render_connecting_screen()
             elif self.game_ended:
                 self.render_game_over_screen()
-            elif not self.game_state or not self.game_state.get("gameStarted"):
+            elif not self.game_state.game_started:
                 self.render_lobby_screen()
             else:
                 self.render_game()
+            if self.reconnecting:
+                self.render_reconnecting_banner()
             pygame.display.flip()
+            if self.first_frame_at is None:
+                self.report_first_frame()
             self.clock.tick(60)
 
     def cleanup(self):
+        # Tell the server we are leaving for good so it doesn't hold our slot
+        if not self.spectating:
+            self.send_message({"type": "leave"})
         self.running = False
+        if self.decompressor:
+            d = self.decompressor
+            print(f"{d.mode}: {d.compressed_bytes} -> {d.raw_bytes} bytes "
+                  f"(ratio {d.ratio():.2f}, {d.cpu_time * 1000:.1f} ms CPU)")
         if self.socket:
             self.socket.close()
-        pygame.mixer.music.stop()  # Stop music before quitting
+        if self.audio_ready:
+            pygame.mixer.music.stop()  # Stop music before quitting
         pygame.quit()
 
 
 if __name__ == "__main__":
-    client = GameClient()
+    parser = argparse.ArgumentParser(description="Capture The Star client")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--name", default=None, help="player name for match history and the leaderboard")
+    parser.add_argument("--spectate", action="store_true", help="watch a match (the server or a relay.py)")
+    parser.add_argument("--match", type=int, default=None, help="match to spectate; defaults to the oldest running")
+    args = parser.parse_args()
+    client = GameClient(args.host, args.port, args.spectate, args.match, args.name)
     try:
         client.run()
     except Exception as e:
@@ -0,0 +1,185 @@
+# Match history and leaderboard, kept in a local SQLite file.
+# Matches hand finished rounds to record_match, which only queues them; a single
+# writer thread commits whatever has queued up in one transaction, so neither
+# the game loop nor the match timers ever wait on the disk.
+import queue
+import sqlite3
+import threading
+import time
+
+HISTORY_DB = "match_history.db"
+FLUSH_INTERVAL = 1.0  # Seconds the writer waits for more rounds before committing a batch
+MAX_BATCH = 256  # Rounds committed in one transaction at most
+MAX_PENDING = 10000  # Rounds queued for the writer before new ones are dropped
+LEADERBOARD_SIZE = 10
+MAX_QUERY_ROWS = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    server_match_id INTEGER NOT NULL,
+    started_at REAL,
+    ended_at REAL NOT NULL,
+    winner_slot INTEGER,
+    winner_name TEXT
+);
+CREATE TABLE IF NOT EXISTS match_players (
+    match_id INTEGER NOT NULL REFERENCES matches(id),
+    slot INTEGER NOT NULL,
+    name TEXT,
+    color TEXT,
+    score INTEGER NOT NULL,
+    red_stars INTEGER NOT NULL,
+    powerups INTEGER NOT NULL,
+    won INTEGER NOT NULL,
+    PRIMARY KEY (match_id, slot)
+);
+CREATE INDEX IF NOT EXISTS match_players_by_name ON match_players (name, match_id DESC);
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    matches INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    total_score INTEGER NOT NULL DEFAULT 0,
+    best_score INTEGER NOT NULL DEFAULT 0,
+    red_stars INTEGER NOT NULL DEFAULT 0,
+    powerups INTEGER NOT NULL DEFAULT 0,
+    last_played REAL
+);
+CREATE INDEX IF NOT EXISTS players_by_rank ON players (wins DESC, total_score DESC);
+"""
+
+# The players table is the leaderboard: kept up to date on every insert so
+# top-N reads walk players_by_rank instead of aggregating every match
+UPDATE_PLAYER = """
+INSERT INTO players (name, matches, wins, total_score, best_score, red_stars, powerups, last_played)
+VALUES (?, 1, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(name) DO UPDATE SET
+    matches = matches + 1,
+    wins = wins + excluded.wins,
+    total_score = total_score + excluded.total_score,
+    best_score = MAX(best_score, excluded.best_score),
+    red_stars = red_stars + excluded.red_stars,
+    powerups = powerups + excluded.powerups,
+    last_played = excluded.last_played
+"""
+
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=10)
+    db.row_factory = sqlite3.Row
+    # WAL lets leaderboard queries read while the writer commits
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+def row_limit(limit):
+    # SQLite reads a negative LIMIT as no limit at all
+    return max(1, min(limit, MAX_QUERY_ROWS))
+
+
+class HistoryStore:
+    def __init__(self, path=HISTORY_DB, metrics=None):
+        self.path = path
+        self.metrics = metrics
+        self.pending = queue.Queue(maxsize=MAX_PENDING)
+        self.local = threading.local()  # Read connection per querying thread
+        db = connect(path)
+        db.executescript(SCHEMA)
+        db.close()
+        self.writer = threading.Thread(target=self.write_loop, name="history-writer")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def record_match(self, result):
+        # result: {"matchId", "startedAt", "endedAt", "winner", "players": [{"slot", "name", "color",
+        # "score", "redStars", "powerups"}]}
+        try:
+            self.pending.put_nowait(result)
+        except queue.Full:
+            print(f"History backlog full, dropping result of match {result['matchId']}")
+            self.count("history.dropped")
+
+    def write_loop(self):
+        db = connect(self.path)
+        while True:
+            batch = [self.pending.get()]
+            # Let rounds that end close together share one commit
+            deadline = time.time() + FLUSH_INTERVAL
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.pending.get(timeout=max(0.0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [result for result in batch if result is not None]
+            if batch:
+                self.write_batch(db, batch)
+            if stop:
+                break
+        db.close()
+
+    def write_batch(self, db, batch):
+        start = time.perf_counter()
+        try:
+            with db:
+                for result in batch:
+                    winner = next((p for p in result["players"] if p["slot"] == result["winner"]), None)
+                    cursor = db.execute(
+                        "INSERT INTO matches (server_match_id, started_at, ended_at, winner_slot, winner_name) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (result["matchId"], result["startedAt"], result["endedAt"], result["winner"],
+                         winner["name"] if winner else None))
+                    match_id = cursor.lastrowid
+                    db.executemany(
+                        "INSERT INTO match_players (match_id, slot, name, color, score, red_stars, powerups, won) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(match_id, p["slot"], p["name"], p["color"], p["score"], p["redStars"], p["powerups"],
+                          int(p["slot"] == result["winner"])) for p in result["players"]])
+                    # Only named players have an identity that carries across matches
+                    db.executemany(UPDATE_PLAYER,
+                                   [(p["name"], int(p["slot"] == result["winner"]), p["score"], p["score"],
+                                     p["redStars"], p["powerups"], result["endedAt"])
+                                    for p in result["players"] if p["name"]])
+        except sqlite3.Error as e:
+            print(f"Error writing match history: {e}")
+            self.count("history.errors")
+            return
+        self.count("history.batches")
+        self.count("history.matches", len(batch))
+        if self.metrics:
+            self.metrics.observe("history.batch_write_seconds", time.perf_counter() - start)
+            self.metrics.set_gauge("history.pending", self.pending.qsize())
+
+    def count(self, name, amount=1):
+        if self.metrics:
+            self.metrics.incr(name, amount)
+
+    def reader(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = connect(self.path)
+        return db
+
+    def leaderboard(self, limit=LEADERBOARD_SIZE):
+        rows = self.reader().execute(
+            "SELECT name, matches, wins, total_score, best_score, red_stars, powerups, last_played FROM players "
+            "ORDER BY wins DESC, total_score DESC LIMIT ?", (row_limit(limit),))
+        return [{"name": row["name"], "matches": row["matches"], "wins": row["wins"],
+                 "totalScore": row["total_score"], "bestScore": row["best_score"], "redStars": row["red_stars"],
+                 "powerups": row["powerups"], "lastPlayed": row["last_played"]} for row in rows]
+
+    def player_history(self, name, limit=LEADERBOARD_SIZE):
+        rows = self.reader().execute(
+            "SELECT m.id, m.server_match_id, m.ended_at, m.winner_name, p.slot, p.score, p.red_stars, p.powerups, "
+            "p.won FROM match_players p JOIN matches m ON m.id = p.match_id "
+            "WHERE p.name = ? ORDER BY p.match_id DESC LIMIT ?", (name, row_limit(limit)))
+        return [{"id": row["id"], "matchId": row["server_match_id"], "endedAt": row["ended_at"],
+                 "winner": row["winner_name"], "slot": row["slot"], "score": row["score"],
+                 "redStars": row["red_stars"], "powerups": row["powerups"], "won": bool(row["won"])}
+                for row in rows]
+
+    def close(self):
+        # Flush what is queued and stop the writer
+        self.pending.put(None)
+        self.writer.join(timeout=5)
@@ -0,0 +1,180 @@
+# Area-of-interest filtering: each client only receives the entities within a
+# radius of its own player. A uniform grid keeps the per-client query cost
+# proportional to the local entity density rather than the match size. After a
+# full view, clients only get what entered and left it and where players moved.
+import json
+import threading
+
+from protocol import encode_message
+
+
+class SpatialGrid:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}  # (cell_x, cell_y): [(x, y, item), ...]
+
+    def clear(self):
+        self.cells.clear()
+
+    def insert(self, item, x, y):
+        key = (int(x // self.cell_size), int(y // self.cell_size))
+        bucket = self.cells.get(key)
+        if bucket is None:
+            self.cells[key] = [(x, y, item)]
+        else:
+            bucket.append((x, y, item))
+
+    def query_radius(self, x, y, radius):
+        cell_size = self.cell_size
+        radius_sq = radius * radius
+        cells = self.cells
+        for cell_x in range(int((x - radius) // cell_size), int((x + radius) // cell_size) + 1):
+            for cell_y in range(int((y - radius) // cell_size), int((y + radius) // cell_size) + 1):
+                for item_x, item_y, item in cells.get((cell_x, cell_y), ()):
+                    if (item_x - x) ** 2 + (item_y - y) ** 2 <= radius_sq:
+                        yield item
+
+    def query_rect(self, x, y, width, height, margin=0):
+        # Items whose insertion point falls inside the rectangle grown by margin on every side
+        cell_size = self.cell_size
+        min_x, min_y = x - margin, y - margin
+        max_x, max_y = x + width + margin, y + height + margin
+        cells = self.cells
+        for cell_x in range(int(min_x // cell_size), int(max_x // cell_size) + 1):
+            for cell_y in range(int(min_y // cell_size), int(max_y // cell_size) + 1):
+                for item_x, item_y, item in cells.get((cell_x, cell_y), ()):
+                    if min_x <= item_x <= max_x and min_y <= item_y <= max_y:
+                        yield item
+
+
+class InterestManager:
+    def __init__(self, radius):
+        self.radius = radius
+        # With cells as large as the radius a query touches at most 3x3 cells
+        self.grid = SpatialGrid(radius)
+        self.visible = {}  # client_id: set of entity keys last sent to that client
+        self.sent_maps = {}  # client_id: obstacle list that client was last sent
+        self.map_json = (None, None)  # (obstacle list, its JSON), encoded once per map
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.visible.clear()
+            self.sent_maps.clear()
+
+    def forget(self, client_id):
+        with self.lock:
+            self.visible.pop(client_id, None)
+            self.sent_maps.pop(client_id, None)
+
+    def viewers(self, keys):
+        # Clients whose last view held any of these entities
+        with self.lock:
+            return {client_id for client_id, visible in self.visible.items() if not visible.isdisjoint(keys)}
+
+    def sees(self, player, x, y):
+        # Whether the point is within the radius of the player, measured like query_radius
+        return (player.x - x) ** 2 + (player.y - y) ** 2 <= self.radius * self.radius
+
+    def compute_views(self, game_state, viewers, tick, moved=(), full=False):
+        # viewers: [(client_id, player_id)]. Returns [(client_id, payload)]: an encoded game_state_update with
+        # the filtered state for clients seeing the match for the first time (or everyone when full), otherwise
+        # an interest_update with what entered and left the view and where visible players moved; None when
+        # nothing changed for that client
+        with self.lock:
+            self.rebuild(game_state)
+            encoded = {}  # Entity key: JSON, so an entity in many views is only encoded once per broadcast
+            return [(client_id, self.view_for(client_id, player_id, game_state, tick, moved, full, encoded))
+                    for client_id, player_id in viewers]
+
+    def rebuild(self, game_state):
+        # Entities are indexed by their top-left corner; they are tiny compared to the radius
+        grid = self.grid
+        grid.clear()
+        for player in game_state.players.values():
+            grid.insert(("player", player.id), player.x, player.y)
+        for powerup in game_state.powerups:
+            if powerup.active:
+                grid.insert(("powerup", powerup.id), powerup.x, powerup.y)
+        shared_obj = game_state.shared_object
+        grid.insert(("sharedObject", None), shared_obj.x, shared_obj.y)
+        red_star = game_state.red_star
+        if red_star.active:
+            grid.insert(("redStar", None), red_star.x, red_star.y)
+
+    def view_for(self, client_id, player_id, game_state, tick, moved, full, encoded):
+        player = game_state.players.get(player_id)
+        if player is None:
+            if not full:
+                return None
+            return encode_message({"type": "game_state_update", "tick": tick, "gameState": game_state.to_dict()})
+
+        visible = set(self.grid.query_radius(player.x, player.y, self.radius))
+        visible.add(("player", player_id))
+        previous = self.visible.get(client_id)
+        self.visible[client_id] = visible
+        powerups_by_id = {powerup.id: powerup for powerup in game_state.powerups}
+        if full or previous is None:
+            return self.full_view(client_id, visible, game_state, tick, powerups_by_id, encoded)
+
+        enter = [{"kind": kind, "id": entity_id, "data": self.entity_data(kind, entity_id, game_state, powerups_by_id)}
+                 for kind, entity_id in visible - previous]
+        leave = [{"kind": kind, "id": entity_id} for kind, entity_id in previous - visible]
+        players = game_state.players
+        positions = [[pid, players[pid].x, players[pid].y] for pid in moved
+                     if ("player", pid) in previous and ("player", pid) in visible]
+        if not (enter or leave or positions):
+            return None
+        return encode_message({"type": "interest_update", "tick": tick, "enter": enter, "leave": leave,
+                               "players": positions})
+
+    def full_view(self, client_id, visible, game_state, tick, powerups_by_id, encoded):
+        # Spliced together from JSON encoded once per broadcast; only the choice of entities is per client
+        header = encoded.get("header")
+        if header is None:
+            header = encoded["header"] = json.dumps({
+                "timeRemaining": game_state.time_remaining,
+                "gameStarted": game_state.game_started,
+                "winner": game_state.winner,
+                "matchId": game_state.match_id,
+                "startsAt": game_state.starts_at,
+                "arenaSize": game_state.arena_size,
+                "maxPlayers": game_state.max_players,
+            })[1:-1]
+        fields = [header]
+        players = []
+        powerups = []
+        for key in sorted(visible):
+            data = encoded.get(key)
+            if data is None:
+                data = encoded[key] = json.dumps(self.entity_data(key[0], key[1], game_state, powerups_by_id))
+            if key[0] == "player":
+                players.append(data)
+            elif key[0] == "powerup":
+                powerups.append(data)
+            else:
+                fields.append(f'"{key[0]}": {data}')
+        fields.append(f'"players": [{", ".join(players)}]')
+        fields.append(f'"powerups": [{", ".join(powerups)}]')
+        # Obstacles don't move during a round: each client gets the map once, and keeps it through later views
+        if self.sent_maps.get(client_id) is not game_state.obstacles:
+            fields.append(f'"obstacles": {self.encoded_map(game_state)}')
+            self.sent_maps[client_id] = game_state.obstacles
+        return f'{{"type": "game_state_update", "tick": {tick}, "gameState": {{{", ".join(fields)}}}}}'.encode('utf-8')
+
+    def encoded_map(self, game_state):
+        obstacles, data = self.map_json
+        if obstacles is not game_state.obstacles:
+            data = json.dumps(game_state.obstacle_payload if game_state.obstacle_payload is not None else
+                              [obstacle.to_dict() for obstacle in game_state.obstacles])
+            self.map_json = (game_state.obstacles, data)
+        return data
+
+    def entity_data(self, kind, entity_id, game_state, powerups_by_id):
+        if kind == "player":
+            return game_state.players[entity_id].to_dict()
+        if kind == "powerup":
+            return powerups_by_id[entity_id].to_dict()
+        if kind == "sharedObject":
+            return game_state.shared_object.to_dict()
+        return game_state.red_star.to_dict()
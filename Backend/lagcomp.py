@@ -0,0 +1,86 @@
+# Lag compensation. Actions are judged at the tick the player was looking at when
+# they took it, rather than the state by the time it reached the server. Movement
+# is simulated here from held directions, so positions need no rewinding: a pickup
+# is timed by the player's view lag. What does need remembering is what was on
+# screen, so the match records the red star's state on each simulation tick.
+# Contested pickups aren't awarded on the spot: the first claim opens a short
+# window, and whoever acted earliest in their own view wins.
+from collections import deque
+
+HISTORY_TICKS = 120  # Ticks of state kept; two seconds at 60 Hz
+MAX_REWIND = 0.2  # Seconds an action can be judged in the past, however laggy the client
+RTT_SLACK = 0.05  # Allowance on top of the measured RTT for a client's reported view
+
+
+class TickRecord:
+    __slots__ = ("tick", "red_star_id", "red_star_active")
+
+    def __init__(self, tick, red_star_id, red_star_active):
+        self.tick = tick
+        self.red_star_id = red_star_id
+        self.red_star_active = red_star_active
+
+
+class TickHistory:
+    def __init__(self, capacity=HISTORY_TICKS):
+        self.records = deque(maxlen=capacity)
+
+    def record(self, tick, red_star_id, red_star_active):
+        self.records.append(TickRecord(tick, red_star_id, red_star_active))
+
+    def at(self, tick):
+        # One record per tick, so the lookup is an index; ticks before the window get the oldest record
+        if not self.records:
+            return None
+        index = tick - self.records[0].tick
+        return self.records[max(0, min(len(self.records) - 1, index))]
+
+    def clear(self):
+        self.records.clear()
+
+
+def rewind_ticks(rtt, step):
+    # How far behind a client with this RTT may be looking
+    return int(min(MAX_REWIND, (rtt or 0.0) + RTT_SLACK) / step)
+
+
+def observed_tick(current_tick, reported_tick, rtt, step):
+    # The client acted on the newest snapshot it had seen. Trust its report only as far
+    # back as its measured RTT allows, and never beyond MAX_REWIND.
+    earliest = current_tick - rewind_ticks(rtt, step)
+    if not isinstance(reported_tick, int):
+        reported_tick = current_tick - int((rtt or 0.0) / step)
+    return max(earliest, min(current_tick, reported_tick))
+
+
+class Contest:
+    # Claims on one prize; the earliest observed tick wins once the window closes
+    __slots__ = ("claims", "deadline")
+
+    def __init__(self):
+        self.claims = []  # (observed tick, arrival order, player_id)
+        self.deadline = None
+
+    def claim(self, observed, player_id, current_tick, window_ticks):
+        if any(claimant == player_id for _, _, claimant in self.claims):
+            return
+        self.claims.append((observed, len(self.claims), player_id))
+        if self.deadline is None:
+            self.deadline = current_tick + window_ticks
+
+    def withdraw(self, player_id):
+        self.claims = [claim for claim in self.claims if claim[2] != player_id]
+        if not self.claims:
+            self.deadline = None
+
+    def is_open(self):
+        return self.deadline is not None
+
+    def is_due(self, current_tick):
+        return self.deadline is not None and current_tick >= self.deadline
+
+    def resolve(self):
+        winner = min(self.claims)[2] if self.claims else None
+        self.claims = []
+        self.deadline = None
+        return winner
@@ -0,0 +1,139 @@
+# Map layouts for rounds: obstacles and powerup spots placed by rejection sampling.
+# Sampling can take a while, so a MapPool worker thread keeps a few seeded layouts
+# ready and starting a round only has to take one.
+import math
+import random
+import secrets
+import threading
+import time
+from collections import deque
+
+from interest import SpatialGrid
+from models import Obstacle, Powerup
+
+MAP_POOL_SIZE = 4  # Layouts kept ready per pool
+MAX_PLACEMENT_ATTEMPTS = 5000  # Candidate positions tried per obstacle or powerup before leaving it out
+
+
+class MapSpec:
+    # Everything a layout depends on; matches with equal specs can share a pool
+    __slots__ = ("canvas_size", "player_size", "object_size", "powerup_size", "num_obstacles", "num_powerups",
+                 "spawn_points", "center")
+
+    def __init__(self, canvas_size, player_size, object_size, powerup_size, num_obstacles, num_powerups,
+                 spawn_points):
+        self.canvas_size = canvas_size
+        self.player_size = player_size
+        self.object_size = object_size
+        self.powerup_size = powerup_size
+        self.num_obstacles = num_obstacles
+        self.num_powerups = num_powerups
+        self.spawn_points = spawn_points  # (x, y) every player may start from
+        self.center = (canvas_size / 2 - object_size / 2, canvas_size / 2 - object_size / 2)  # Shared object start
+
+
+class MapLayout:
+    __slots__ = ("seed", "obstacles", "powerup_spots", "obstacle_payload", "generate_ms")
+
+    def __init__(self, seed, obstacles, powerup_spots, generate_ms):
+        self.seed = seed
+        self.obstacles = obstacles
+        self.powerup_spots = powerup_spots  # (x, y, type)
+        # Obstacles don't change during a round, so they are serialized once here rather than in every broadcast
+        self.obstacle_payload = [obstacle.to_dict() for obstacle in obstacles]
+        self.generate_ms = generate_ms
+
+    def powerups(self):
+        # Fresh objects each time; powerups are switched off as they are collected
+        return [Powerup(index, x, y, kind) for index, (x, y, kind) in enumerate(self.powerup_spots)]
+
+
+def overlaps(x1, y1, size1, x2, y2, size2):
+    return x1 < x2 + size2 and x1 + size1 > x2 and y1 < y2 + size2 and y1 + size1 > y2
+
+
+def generate_layout(spec, seed):
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    center_x, center_y = spec.center
+    obstacle_size = spec.player_size * 2
+    obstacle_gap = spec.player_size * 2.5
+    spawn_gap = spec.player_size * 4
+    spot_gap = spec.player_size * 5
+    # Spacing checks only look at nearby cells, so large maps don't cost quadratic time
+    spawn_grid = SpatialGrid(spawn_gap)
+    for px, py in spec.spawn_points:
+        spawn_grid.insert((px, py), px, py)
+    obstacle_grid = SpatialGrid(obstacle_gap)
+    obstacles = []
+    attempts = 0
+    while len(obstacles) < spec.num_obstacles and attempts < MAX_PLACEMENT_ATTEMPTS * spec.num_obstacles:
+        attempts += 1
+        x = rng.uniform(0, spec.canvas_size - spec.player_size * 4)
+        y = rng.uniform(0, spec.canvas_size - spec.player_size * 4)
+        if any(math.hypot(obs.x - x, obs.y - y) < obstacle_gap
+               for obs in obstacle_grid.query_radius(x, y, obstacle_gap)):
+            continue
+        if any(math.hypot(px - x, py - y) < spawn_gap for px, py in spawn_grid.query_radius(x, y, spawn_gap)):
+            continue
+        if math.hypot(center_x - x, center_y - y) < spec.object_size * 3:
+            continue
+        obstacle = Obstacle(x, y, obstacle_size, "ice")
+        obstacles.append(obstacle)
+        obstacle_grid.insert(obstacle, x, y)
+
+    spots = []
+    spot_grid = SpatialGrid(spot_gap)
+    kinds = ["speed"] * (spec.num_powerups // 2) + ["slow"] * (spec.num_powerups // 2)
+    for kind in kinds:
+        for _ in range(MAX_PLACEMENT_ATTEMPTS):
+            x = rng.uniform(0, spec.canvas_size - spec.powerup_size)
+            y = rng.uniform(0, spec.canvas_size - spec.powerup_size)
+            if not any(math.hypot(px - x, py - y) < spot_gap for px, py in spot_grid.query_radius(x, y, spot_gap)) and \
+                    not any(overlaps(x, y, spec.powerup_size, obs.x, obs.y, obs.size)
+                            for obs in obstacle_grid.query_rect(x, y, spec.powerup_size, spec.powerup_size,
+                                                                obstacle_size)) and \
+                    math.hypot(center_x - x, center_y - y) >= spec.object_size * 5:
+                spots.append((x, y, kind))
+                spot_grid.insert((x, y), x, y)
+                break
+    if len(obstacles) < spec.num_obstacles or len(spots) < len(kinds):
+        print(f"Map {seed} is short: {len(obstacles)}/{spec.num_obstacles} obstacles, "
+              f"{len(spots)}/{len(kinds)} powerups")
+    return MapLayout(seed, obstacles, spots, (time.perf_counter() - start) * 1000)
+
+
+class MapPool:
+    def __init__(self, spec, size=MAP_POOL_SIZE, metrics=None):
+        self.spec = spec
+        self.size = size
+        self.metrics = metrics
+        self.layouts = deque()
+        self.condition = threading.Condition()
+        self.worker = threading.Thread(target=self.fill_loop, name="map-pool")
+        self.worker.daemon = True
+        self.worker.start()
+
+    def fill_loop(self):
+        while True:
+            with self.condition:
+                while len(self.layouts) >= self.size:
+                    self.condition.wait()
+            # Generate outside the lock so take() never waits on sampling
+            layout = generate_layout(self.spec, secrets.randbits(32))
+            with self.condition:
+                self.layouts.append(layout)
+            if self.metrics:
+                self.metrics.incr("maps.generated")
+                self.metrics.observe("maps.generate_ms", layout.generate_ms)
+
+    def take(self):
+        with self.condition:
+            layout = self.layouts.popleft() if self.layouts else None
+            self.condition.notify()
+        if layout is None:
+            # Rounds started faster than the worker keeps up; pay for this one inline
+            if self.metrics:
+                self.metrics.incr("maps.pool_empty")
+            layout = generate_layout(self.spec, secrets.randbits(32))
+        return layout
@@ -0,0 +1,898 @@
+# A single match: its game state, the connections of its players and all game rules.
+# GameServer (server.py) owns the sockets and hands players to matches through the matchmaker.
+import colorsys
+import math
+import threading
+import time
+import random
+import secrets
+
+from models import GameState, Player, SharedObject, RedStar
+from interest import InterestManager, SpatialGrid
+from lagcomp import Contest, TickHistory, observed_tick, rewind_ticks
+from mapgen import MapSpec
+from profiling import timed
+from protocol import encode_message
+from snapshot_ring import SnapshotRing, ring_path
+from spectator import SnapshotFeed
+
+# Game Constants
+CANVAS_SIZE = 700  # The classic 4-player arena; MatchSettings scales other sizes from it
+PLAYER_SIZE = 30
+OBJECT_SIZE = 20
+POWERUP_SIZE = 15
+RED_STAR_SIZE = 25  # Size of the special red star
+GAME_DURATION = 120
+BASE_SPEED = 5
+SPEED_BOOST = 3
+SPEED_PENALTY = 2
+NUM_OBSTACLES = 18  # On a CANVAS_SIZE arena; larger arenas get the same density
+NUM_POWERUPS = 4
+MAX_PLAYERS = 4  # Default slots per match
+MAX_PLAYERS_LIMIT = 64
+MIN_ARENA_SIZE = 400
+MAX_ARENA_SIZE = 4000
+RED_STAR_POINTS = 5  # Points awarded for collecting the red star
+RED_STAR_CLICKS_REQUIRED = 5  # Clicks required to collect the red star
+RED_STAR_DURATION = 5  # Duration in seconds that the red star stays on screen
+RED_STAR_MIN_INTERVAL = 15  # Minimum seconds between red star appearances
+RED_STAR_MAX_INTERVAL = 30  # Maximum seconds between red star appearances
+INTEREST_RADIUS = None  # Area-of-interest radius in pixels; None sends every entity to every client
+MIN_PLAYERS_TO_START = 2  # A lobby with this many players starts on its own after AUTO_START_DELAY
+AUTO_START_DELAY = 10  # Seconds from reaching MIN_PLAYERS_TO_START (or the end of a round) to the next round
+FULL_MATCH_START_DELAY = 3  # Seconds before a full lobby starts
+RESUME_GRACE_PERIOD = 15  # Seconds a dropped player's slot is held for them to reconnect
+SIMULATION_RATE = 60  # Movement steps per second; a player moves speed pixels per step
+SIMULATION_STEP = 1.0 / SIMULATION_RATE
+MAX_CATCHUP_STEPS = 5  # Steps run at most in one tick after a stall, so a hiccup can't teleport players
+RESYNC_INTERVAL = 5  # Seconds between full snapshots during a round; events and position deltas fill the gaps
+SNAPSHOT_REFRESH_INTERVAL = 0.05  # Seconds between full snapshots for spectators and the ring while events stream in
+SPAWN_MARGIN = 10  # Gap between a spawn point and the arena edge
+CLASSIC_COLORS = ["red", "purple", "blue", "green"]  # Slots 1-4; later slots get generated "#rrggbb" colours
+MAX_STEP_DISTANCE = BASE_SPEED + SPEED_BOOST  # Furthest a player moves in one simulation step
+COLLISION_CELL_SIZE = PLAYER_SIZE * 4
+
+
+def radical_inverse(index):
+    # Base-2 van der Corput sequence: 0, 1/2, 1/4, 3/4, 1/8, ... Any prefix is spread evenly over [0, 1)
+    result, weight = 0.0, 0.5
+    while index:
+        if index & 1:
+            result += weight
+        index >>= 1
+        weight /= 2
+    return result
+
+
+def spawn_points(arena_size, count):
+    # Around the arena edge, anticlockwise from the top-left corner. Slot k sits at radical_inverse(k) of the
+    # way round, so slots 1-4 are the corners (opposite corners first) and a partly full match is still spread out
+    side = arena_size - PLAYER_SIZE - 2 * SPAWN_MARGIN
+    points = []
+    for index in range(count):
+        edge, along = divmod(radical_inverse(index) * 4 * side, side)
+        low, high = SPAWN_MARGIN + along, SPAWN_MARGIN + side - along
+        x, y = [(SPAWN_MARGIN, low), (low, SPAWN_MARGIN + side), (SPAWN_MARGIN + side, high),
+                (high, SPAWN_MARGIN)][int(edge)]
+        points.append((round(x), round(y)))
+    return points
+
+
+def min_arena_size(max_players):
+    # Neighbouring spawn points are at least a 2^ceil(log2 n)-th of the way round apart; keep that two players wide
+    slices = 1 << max(0, max_players - 1).bit_length()
+    return max(MIN_ARENA_SIZE, math.ceil(2 * PLAYER_SIZE * slices / 4) + PLAYER_SIZE + 2 * SPAWN_MARGIN)
+
+
+def player_colors(count):
+    colors = CLASSIC_COLORS[:count]
+    for index in range(len(colors), count):
+        # Golden-angle hue steps keep consecutive slots far apart on the colour wheel
+        r, g, b = colorsys.hsv_to_rgb((index * 0.381966) % 1.0, 0.75, 0.95)
+        colors.append(f"#{int(r * 255):02x}{int(g * 255):02x}{int(b * 255):02x}")
+    return colors
+
+
+class MatchSettings:
+    # Arena size and player count of a match; everything else on the map scales from them
+    __slots__ = ("max_players", "arena_size", "spawn_points", "colors", "map_spec")
+
+    def __init__(self, max_players=MAX_PLAYERS, arena_size=None):
+        if not 1 <= max_players <= MAX_PLAYERS_LIMIT:
+            raise ValueError(f"max_players must be between 1 and {MAX_PLAYERS_LIMIT}")
+        if arena_size is None:
+            # Same room per player as the classic 4-player arena
+            arena_size = max(CANVAS_SIZE, round(CANVAS_SIZE * math.sqrt(max_players / MAX_PLAYERS)))
+        if not min_arena_size(max_players) <= arena_size <= MAX_ARENA_SIZE:
+            raise ValueError(f"arena_size for {max_players} players must be between "
+                             f"{min_arena_size(max_players)} and {MAX_ARENA_SIZE}")
+        self.max_players = max_players
+        self.arena_size = arena_size
+        self.spawn_points = spawn_points(arena_size, max_players)
+        self.colors = player_colors(max_players)
+        # Obstacle and powerup density stay those of the classic arena
+        scale = (arena_size / CANVAS_SIZE) ** 2
+        self.map_spec = MapSpec(arena_size, PLAYER_SIZE, OBJECT_SIZE, POWERUP_SIZE, round(NUM_OBSTACLES * scale),
+                                2 * max(1, round(NUM_POWERUPS / 2 * scale)), self.spawn_points)
+
+    def key(self):
+        # Matches with equal keys share a MapPool
+        return self.max_players, self.arena_size
+
+
+class Match:
+    def __init__(self, match_id, server, interest_radius=INTEREST_RADIUS, settings=None):
+        self.match_id = match_id
+        self.server = server
+        self.settings = settings or MatchSettings()
+        self.connections = {}  # client_id: ClientConnection of a player in this match
+        # Guards the game state; message handlers, timers and the server tick all run on different threads
+        self.lock = threading.RLock()
+
+        self.game_state = GameState(
+            SharedObject(*self.settings.map_spec.center),
+            RedStar(RED_STAR_CLICKS_REQUIRED),
+            GAME_DURATION
+        )
+        self.game_state.match_id = match_id
+        self.game_state.arena_size = self.settings.arena_size
+        self.game_state.max_players = self.settings.max_players
+        # Obstacles and powerup spots are fixed for a round; players are re-indexed every step
+        self.obstacle_grid = SpatialGrid(COLLISION_CELL_SIZE)
+        self.powerup_grid = SpatialGrid(COLLISION_CELL_SIZE)
+        self.player_grid = SpatialGrid(COLLISION_CELL_SIZE)
+        self.max_obstacle_size = 0
+        self.game_timer = None
+        self.red_star_timer = None
+        self.interest = InterestManager(interest_radius) if interest_radius else None
+        self.resume_tokens = {}  # resume token: player_id
+        self.held = {}  # player_id: grace period Timer of a dropped player
+        self.feed = SnapshotFeed(match_id)  # Full snapshots for spectators and relays
+        self.names = {}  # player_id: name from the hello, for history and the leaderboard
+        self.round_stats = {}  # player_id: red stars and powerups picked up this round
+        self.round_started_at = None
+        self.inputs = {}  # player_id: (dx, dy) the player is holding
+        self.last_tick_at = time.monotonic()
+        self.unsimulated = 0.0  # Seconds of game time not yet covered by a simulation step
+        self.last_snapshot_at = 0.0
+        self.feed_stale = False  # Events went out since the spectator feed's last full snapshot
+        self.ring = None
+        if server.ring_dir:
+            # A bad ring directory costs local readers their ring, not the match
+            try:
+                self.ring = SnapshotRing(ring_path(server.ring_dir, match_id), match_id, metrics=server.metrics)
+            except OSError as e:
+                print(f"Match {match_id} has no snapshot ring: {e}")
+                server.metrics.incr("ring.errors")
+        self.last_published_at = 0.0
+        # Lag compensation: every outgoing update carries tick_count and clients echo the last one they saw
+        self.tick_count = 0  # Simulation steps taken this round
+        self.history = TickHistory()  # What was on screen each tick, for actions judged in the past
+        self.view_lag = {}  # player_id: ticks the player's view was behind when their last action arrived
+        self.star_contest = Contest()
+        self.red_star_contest = Contest()
+        self.star_placed_tick = 0
+        self.red_star_id = 0  # Numbers each red star appearance
+        self.red_star_claimed = None  # red_star_id already awarded
+
+    def free_slots(self):
+        return self.settings.max_players - len(self.game_state.players)
+
+    def is_joinable(self):
+        return not self.game_state.game_started and self.free_slots() > 0
+
+    def is_empty(self):
+        return not self.game_state.players
+
+    def add_player(self, client_id, connection):
+        with self.lock:
+            # Take the lowest free slot; it decides the spawn point and colour
+            player_id = next(pid for pid in range(1, self.settings.max_players + 1)
+                             if pid not in self.game_state.players)
+            self.game_state.players[player_id] = self.new_player(player_id)
+            connection.player_id = player_id
+            connection.match = self
+            self.names[player_id] = connection.name
+            token = self.issue_token(player_id)
+            try:
+                connection.send_message({"type": "connection_accepted", "playerId": player_id,
+                                         "matchId": self.match_id, "tick": self.tick_count,
+                                         "gameState": self.game_state.to_dict(),
+                                         "compression": connection.compression_mode, "resumeToken": token})
+            except Exception:
+                del self.game_state.players[player_id]
+                del self.resume_tokens[token]
+                raise
+            # Everything after connection_accepted goes through the connection's compression stream
+            connection.enable_compression()
+            self.connections[client_id] = connection
+            if len(self.game_state.players) == 1 and not self.game_state.game_started:
+                self.initialize_game_map()
+            self.arm_auto_start()
+            self.broadcast_game_state()
+        return player_id
+
+    def new_player(self, player_id):
+        x, y = self.settings.spawn_points[player_id - 1]
+        return Player(player_id, x, y, BASE_SPEED, self.settings.colors[player_id - 1])
+
+    def issue_token(self, player_id):
+        token = secrets.token_urlsafe(16)
+        self.resume_tokens[token] = player_id
+        return token
+
+    def has_token(self, token):
+        return token in self.resume_tokens
+
+    def remove_player(self, client_id):
+        # The player left on purpose; free the slot straight away
+        with self.lock:
+            connection = self.connections.pop(client_id, None)
+            if connection is None:
+                return
+            if self.interest:
+                self.interest.forget(client_id)
+            self.drop_player(connection.player_id)
+
+    def suspend_player(self, client_id):
+        # The connection dropped; keep the player in the match for RESUME_GRACE_PERIOD
+        with self.lock:
+            connection = self.connections.pop(client_id, None)
+            if connection is None:
+                return
+            if self.interest:
+                self.interest.forget(client_id)
+            player = self.game_state.players.get(connection.player_id)
+            if player is None:
+                return
+            print(f"Holding Player {player.id} in match {self.match_id} for {RESUME_GRACE_PERIOD}s")
+            player.connected = False
+            self.inputs.pop(player.id, None)
+            timer = threading.Timer(RESUME_GRACE_PERIOD, self.expire_player, args=(player.id,))
+            timer.daemon = True
+            self.held[player.id] = timer
+            timer.start()
+            self.broadcast_game_state()
+
+    def expire_player(self, player_id):
+        with self.lock:
+            # A resume that won the race already cancelled the hold
+            if self.held.pop(player_id, None) is None:
+                return
+            print(f"Player {player_id} did not resume in time")
+            self.drop_player(player_id)
+
+    def resume_player(self, client_id, connection, token):
+        with self.lock:
+            player_id = self.resume_tokens.get(token)
+            player = self.game_state.players.get(player_id)
+            if player is None:
+                return False
+            # Tokens are single use; the catch-up snapshot carries the next one
+            new_token = self.issue_token(player_id)
+            player.connected = True
+            try:
+                connection.send_message({"type": "resumed", "playerId": player_id, "matchId": self.match_id,
+                                         "tick": self.tick_count,
+                                         "gameState": self.game_state.to_dict(),
+                                         "compression": connection.compression_mode, "resumeToken": new_token})
+            except Exception:
+                del self.resume_tokens[new_token]
+                player.connected = player_id not in self.held
+                return False
+            del self.resume_tokens[token]
+            timer = self.held.pop(player_id, None)
+            if timer:
+                timer.cancel()
+            # The resume can arrive before we notice the old socket died
+            for old_id, old in list(self.connections.items()):
+                if old.player_id == player_id:
+                    del self.connections[old_id]
+                    old.abort()
+            connection.player_id = player_id
+            connection.match = self
+            connection.enable_compression()
+            self.connections[client_id] = connection
+            print(f"Player {player_id} resumed in match {self.match_id}")
+            self.broadcast_game_state()
+            return True
+
+    def drop_player(self, player_id):
+        timer = self.held.pop(player_id, None)
+        if timer:
+            timer.cancel()
+        self.resume_tokens = {token: pid for token, pid in self.resume_tokens.items() if pid != player_id}
+        self.game_state.players.pop(player_id, None)
+        self.names.pop(player_id, None)
+        self.round_stats.pop(player_id, None)
+        self.inputs.pop(player_id, None)
+        self.view_lag.pop(player_id, None)
+        self.star_contest.withdraw(player_id)
+        self.red_star_contest.withdraw(player_id)
+        if not self.game_state.players and self.game_state.game_started:
+            self.game_state.game_started = False
+            if self.game_timer:
+                self.game_timer.cancel()
+                self.game_timer = None
+            if self.red_star_timer:
+                self.red_star_timer.cancel()
+                self.red_star_timer = None
+        self.arm_auto_start()
+        self.broadcast_game_state()
+
+    def arm_auto_start(self, rematch=False):
+        # Lobbies start on their own so nobody has to wait for Player 1 to press Start
+        state = self.game_state
+        if state.game_started:
+            return
+        player_count = len(state.players)
+        now = time.time()
+        if player_count >= self.settings.max_players:
+            delay = AUTO_START_DELAY if rematch else FULL_MATCH_START_DELAY
+            state.starts_at = min(state.starts_at or now + delay, now + delay)
+        elif player_count >= MIN_PLAYERS_TO_START:
+            state.starts_at = state.starts_at or now + AUTO_START_DELAY
+        else:
+            state.starts_at = None
+
+    @timed
+    def tick(self):
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.last_tick_at
+            self.last_tick_at = now
+            state = self.game_state
+            if state.game_started:
+                # Fixed-size steps however irregular the server loop is
+                self.unsimulated = min(self.unsimulated + elapsed, SIMULATION_STEP * MAX_CATCHUP_STEPS)
+                moved = set()
+                while self.unsimulated >= SIMULATION_STEP:
+                    self.unsimulated -= SIMULATION_STEP
+                    self.tick_count += 1
+                    moved.update(self.step_players())
+                    self.history.record(self.tick_count, self.red_star_id, state.red_star.active)
+                    self.settle_contests()
+                # One update per tick covers every step taken in it
+                if now - self.last_snapshot_at >= RESYNC_INTERVAL:
+                    self.broadcast_game_state()
+                elif moved:
+                    self.broadcast_positions(moved)
+                # A full encode costs as much as the rest of a large tick, so spectators get at most one per interval
+                if self.feed_stale and (self.feed.has_subscribers() or self.ring) and \
+                        now - self.last_published_at >= SNAPSHOT_REFRESH_INTERVAL:
+                    self.publish_snapshot()
+
+                current_time = time.time() * 1000
+                for player in state.players.values():
+                    player.speed_boost = max(0, player.speed_boost)
+                    player.speed_penalty = max(0, player.speed_penalty)
+
+                # Check if red star has expired
+                red_star = state.red_star
+                if red_star.active and time.time() > red_star.expires_at:
+                    self.expire_red_star()
+            else:
+                self.unsimulated = 0.0
+                if state.starts_at and time.time() >= state.starts_at:
+                    print(f"Auto-starting match {self.match_id}")
+                    self.start_game()
+
+    def shutdown(self):
+        with self.lock:
+            if self.game_timer:
+                self.game_timer.cancel()
+            if self.red_star_timer:
+                self.red_star_timer.cancel()
+            for timer in self.held.values():
+                timer.cancel()
+            if self.ring:
+                self.ring.close()
+                self.ring = None
+        self.feed.close()
+
+    def handle_message(self, client_id, message):
+        with self.lock:
+            self.process_client_message(client_id, message)
+
+    def process_client_message(self, client_id, message):
+        # Process the message from the client
+        msg_type = message.get("type")
+        # Get the player ID from the client
+        connection = self.connections[client_id]
+        player_id = connection.player_id
+        # Check if the player ID is valid
+        if msg_type == "input":
+            # Always applies to the sender's own player
+            self.observe(connection, message.get("tick"))
+            self.set_input(player_id, message.get("dx"), message.get("dy"))
+        # Check if the message is to start the game
+        elif msg_type == "start_game" and player_id == 1:
+            print("Starting game by Player 1")
+            self.start_game()
+        # Check if the message is to click the red star
+        elif msg_type == "click_red_star":
+            received_player_id = message.get("playerId")
+            if received_player_id == player_id:
+                print(f"Player {player_id} clicked red star")
+                self.handle_red_star_click(player_id, self.observe(connection, message.get("tick")))
+
+    def observe(self, connection, reported_tick):
+        # The tick the player was looking at when they acted, bounded by their measured RTT
+        observed = observed_tick(self.tick_count, reported_tick, connection.rtt, SIMULATION_STEP)
+        self.view_lag[connection.player_id] = self.tick_count - observed
+        return observed
+
+    def claim_window(self):
+        # A later claim can only beat an earlier one by as much as the laggiest player's view may be behind
+        return max((rewind_ticks(connection.rtt, SIMULATION_STEP) for connection in self.connections.values()),
+                   default=0)
+
+    @timed
+    def handle_red_star_click(self, player_id, observed):
+        red_star = self.game_state.red_star
+        if self.red_star_claimed == self.red_star_id:
+            return
+        if not red_star.active or time.time() > red_star.expires_at:
+            # Gone here, but a click still counts if the star was up on the player's screen
+            seen = self.history.at(observed)
+            if seen is None or not seen.red_star_active or seen.red_star_id != self.red_star_id:
+                return
+
+        # Find the player
+        player = self.game_state.players.get(player_id)
+        if not player:
+            return
+
+        # Check if player's position is within range of the red star (more lenient)
+        # Calculate distance between player center and red star center
+        # player_center_x = player["x"] + PLAYER_SIZE / 2
+        # player_center_y = player["y"] + PLAYER_SIZE / 2
+        # star_center_x = red_star["x"] + RED_STAR_SIZE / 2
+        # star_center_y = red_star["y"] + RED_STAR_SIZE / 2
+
+        # # Use a more generous interaction range - player can click from a distance
+        # interaction_distance = PLAYER_SIZE + RED_STAR_SIZE * 5  # More lenient distance
+        # distance = ((player_center_x - star_center_x) ** 2 + (player_center_y - star_center_y) ** 2) ** 0.5
+
+        # if distance > interaction_distance:
+        #     print(f"Player {player_id} clicked but is too far from red star")
+        #     return
+
+        # Update clicks for this player
+        clicks = red_star.clicks_by_player.get(player_id, 0) + 1
+        red_star.clicks_by_player[player_id] = clicks
+
+        print(f"Player {player_id} clicked red star ({clicks}/{RED_STAR_CLICKS_REQUIRED})")
+
+        # Finishing only claims the star; settle_contests awards it to whoever finished first in their own view
+        if clicks == RED_STAR_CLICKS_REQUIRED:
+            self.red_star_contest.claim(observed, player_id, self.tick_count, self.claim_window())
+
+        self.broadcast_event({"type": "red_star_progress", "playerId": player_id, "clicks": clicks,
+                              "collected": False, "score": player.score}, (("redStar", None), ("player", player_id)))
+
+    def settle_contests(self, force=False):
+        if self.red_star_contest.is_open() and (force or self.red_star_contest.is_due(self.tick_count)):
+            self.award_red_star(self.red_star_contest.resolve())
+        if self.star_contest.is_open() and (force or self.star_contest.is_due(self.tick_count)):
+            self.award_star(self.star_contest.resolve())
+
+    def award_red_star(self, player_id):
+        player = self.game_state.players.get(player_id)
+        if not player:
+            return
+        red_star = self.game_state.red_star
+        print(f"Player {player_id} collected red star! +{RED_STAR_POINTS} points")
+        player.score += RED_STAR_POINTS
+        self.tally(player_id, "redStars")
+        self.red_star_claimed = self.red_star_id
+        red_star.active = False
+        red_star.clicks_by_player = {}
+        if self.red_star_timer:
+            self.red_star_timer.cancel()
+        self.schedule_red_star()
+        self.broadcast_event({"type": "red_star_progress", "playerId": player_id,
+                              "clicks": RED_STAR_CLICKS_REQUIRED, "collected": True, "score": player.score},
+                             (("redStar", None), ("player", player_id)))
+
+
+    def set_input(self, player_id, dx, dy):
+        # Clients send their direction only when it changes; tick() moves players while it is held
+        dx = max(-1, min(1, int(dx or 0)))
+        dy = max(-1, min(1, int(dy or 0)))
+        if dx or dy:
+            self.inputs[player_id] = (dx, dy)
+        else:
+            self.inputs.pop(player_id, None)
+
+    def step_players(self):
+        grid = self.player_grid
+        grid.clear()
+        for player in self.game_state.players.values():
+            grid.insert(player, player.x, player.y)
+        moved = []
+        for player_id, (dx, dy) in list(self.inputs.items()):
+            player = self.game_state.players.get(player_id)
+            if player is not None and player.connected and self.move_player(player, dx, dy):
+                moved.append(player_id)
+        return moved
+
+    def current_speed(self, player, current_time):
+        speed = player.speed
+        if player.speed_boost > current_time:
+            speed += SPEED_BOOST
+        if player.speed_penalty > current_time:
+            speed = max(2, speed - SPEED_PENALTY)
+        return speed
+
+    @timed
+    def move_player(self, player, dx, dy):
+        # One simulation step. Speed is pixels per step, so players cover the same ground
+        # at SIMULATION_RATE whatever the client's frame rate or message rate.
+        current_time = time.time() * 1000
+        distance = self.current_speed(player, current_time)
+        old_x, old_y = player.x, player.y
+        # Axis by axis, so a blocked diagonal still slides along the free axis
+        if dx:
+            player.x = self.sweep(player, 0, dx * distance)
+        if dy:
+            player.y = self.sweep(player, 1, dy * distance)
+        if player.x == old_x and player.y == old_y:
+            return False
+        self.collect_pickups(player, current_time)
+        return True
+
+    def sweep(self, player, axis, delta):
+        # Swept AABB along one axis: stop flush against the nearest obstacle or player in the way,
+        # so fast players can't tunnel and nobody stops short of a wall
+        position = (player.x, player.y)
+        start = position[axis]
+        cross = position[1 - axis]
+        target = max(0, min(self.settings.arena_size - PLAYER_SIZE, start + delta))
+        # Only what lies along the swept box; players are indexed at the start of the step and
+        # may have moved since, hence the wider margin
+        low = min(start, target)
+        span = abs(target - start) + PLAYER_SIZE
+        x, y, width, height = (low, cross, span, PLAYER_SIZE) if axis == 0 else (cross, low, PLAYER_SIZE, span)
+        blockers = [(obstacle.x, obstacle.y, obstacle.size)
+                    for obstacle in self.obstacle_grid.query_rect(x, y, width, height, self.max_obstacle_size)]
+        blockers += [(other.x, other.y, PLAYER_SIZE)
+                     for other in self.player_grid.query_rect(x, y, width, height, PLAYER_SIZE + MAX_STEP_DISTANCE)
+                     if other is not player]
+        for bx, by, size in blockers:
+            b_start, b_cross = (bx, by) if axis == 0 else (by, bx)
+            # Only boxes overlapping our span on the other axis are in the path
+            if cross >= b_cross + size or cross + PLAYER_SIZE <= b_cross:
+                continue
+            if delta > 0 and start + PLAYER_SIZE <= b_start:
+                target = min(target, b_start - PLAYER_SIZE)
+            elif delta < 0 and start >= b_start + size:
+                target = max(target, b_start + size)
+            # Boxes we already overlap (e.g. after a resume) are ignored so the player can walk out
+        return target
+
+    def collect_pickups(self, player, current_time):
+        for powerup in self.powerup_grid.query_rect(player.x, player.y, PLAYER_SIZE, PLAYER_SIZE, POWERUP_SIZE):
+            if powerup.active and self.check_collision(player.x, player.y, PLAYER_SIZE, powerup.x, powerup.y,
+                                                       POWERUP_SIZE):
+                powerup.active = False
+                self.tally(player.id, "powerups")
+                if powerup.type == "speed":
+                    print(f"[Server] ⚡ Player {player.id} collected speed powerup")
+                    player.speed_boost = current_time + 8000
+                elif powerup.type == "slow":
+                    print(f"[Server] 🧊 Player {player.id} collected slow powerup")
+                    player.speed_penalty = current_time + 10000
+                self.broadcast_event({"type": "powerup_taken", "id": powerup.id, "playerId": player.id,
+                                      "speedBoost": player.speed_boost, "speedPenalty": player.speed_penalty},
+                                     (("powerup", powerup.id), ("player", player.id)))
+
+        # Shared object collection
+        shared_obj = self.game_state.shared_object
+        if not shared_obj.is_held and self.check_collision(player.x, player.y, PLAYER_SIZE, shared_obj.x, shared_obj.y,
+                                                           OBJECT_SIZE):
+            # Judged by when the player set off in their own view, but never before the star was there to see
+            observed = max(self.star_placed_tick, self.tick_count - self.view_lag.get(player.id, 0))
+            self.star_contest.claim(observed, player.id, self.tick_count, self.claim_window())
+
+    def award_star(self, player_id):
+        player = self.game_state.players.get(player_id)
+        if not player:
+            return
+        shared_obj = self.game_state.shared_object
+        print(f"[Server] 🌟 Player {player.id} collected shared object")
+        new_obj_x, new_obj_y = self.free_spot(OBJECT_SIZE)
+        shared_obj.x = new_obj_x
+        shared_obj.y = new_obj_y
+        self.star_placed_tick = self.tick_count
+        player.score += 1
+        print(
+            f"[Server] 🎯 New object location: ({new_obj_x}, {new_obj_y}) — Player {player.id} score: {player.score}")
+        self.broadcast_event({"type": "star_collected", "playerId": player.id, "score": player.score,
+                              "x": new_obj_x, "y": new_obj_y}, (("sharedObject", None), ("player", player.id)),
+                             moved_to=(new_obj_x, new_obj_y))
+
+    def tally(self, player_id, stat):
+        stats = self.round_stats.setdefault(player_id, {"redStars": 0, "powerups": 0})
+        stats[stat] += 1
+
+    def check_collision(self, x1, y1, size1, x2, y2, size2):
+        return (x1 < x2 + size2 and x1 + size1 > x2 and y1 < y2 + size2 and y1 + size1 > y2)
+
+    @timed
+    def free_spot(self, size, avoid_star=False):
+        # A random position clear of obstacles and active powerups (and the star, if asked)
+        limit = self.settings.arena_size - size
+        shared_obj = self.game_state.shared_object
+        while True:
+            x = random.randint(0, limit)
+            y = random.randint(0, limit)
+            if any(self.check_collision(x, y, size, obstacle.x, obstacle.y, obstacle.size)
+                   for obstacle in self.obstacle_grid.query_rect(x, y, size, size, self.max_obstacle_size)):
+                continue
+            if any(powerup.active and self.check_collision(x, y, size, powerup.x, powerup.y, POWERUP_SIZE)
+                   for powerup in self.powerup_grid.query_rect(x, y, size, size, POWERUP_SIZE)):
+                continue
+            if avoid_star and self.check_collision(x, y, size, shared_obj.x, shared_obj.y, OBJECT_SIZE):
+                continue
+            return x, y
+
+    def start_game(self):
+        self.game_state.starts_at = None
+        for player in self.game_state.players.values():
+            player.x, player.y = self.settings.spawn_points[player.id - 1]
+            player.score = 0
+            player.speed_boost = 0
+            player.speed_penalty = 0
+        shared_obj = self.game_state.shared_object
+        shared_obj.x, shared_obj.y = self.settings.map_spec.center
+        shared_obj.is_held = False
+        shared_obj.holder_id = None
+        self.initialize_game_map()
+        self.game_state.time_remaining = GAME_DURATION
+        self.game_state.game_started = True
+        self.game_state.winner = None
+        self.game_state.red_star.active = False
+        self.game_state.red_star.clicks_by_player = {}
+        self.round_stats = {}
+        self.tick_count = 0
+        self.history.clear()
+        self.star_contest = Contest()
+        self.red_star_contest = Contest()
+        self.star_placed_tick = 0
+        self.red_star_claimed = None
+        self.round_started_at = time.time()
+
+        print(f"Match {self.match_id} started")
+        self.broadcast_game_state()
+
+        if self.game_timer:
+            self.game_timer.cancel()
+        self.game_timer = threading.Timer(1.0, self.update_game_timer)
+        self.game_timer.daemon = True
+        self.game_timer.start()
+
+        # Schedule the first red star appearance
+        self.schedule_red_star()
+
+    def schedule_red_star(self):
+        if not self.game_state.game_started:
+            return
+
+        interval = random.randint(RED_STAR_MIN_INTERVAL, RED_STAR_MAX_INTERVAL)
+        print(f"[Server] Scheduling red star to appear in {interval} seconds")
+
+        if self.red_star_timer:
+            self.red_star_timer.cancel()
+
+        self.red_star_timer = threading.Timer(interval, self.spawn_red_star)
+        self.red_star_timer.daemon = True
+        self.red_star_timer.start()
+
+    def spawn_red_star(self):
+        with self.lock:
+            self.place_red_star()
+
+    def place_red_star(self):
+        if not self.game_state.game_started:
+            return
+
+        print("[Server] 🔴 Spawning red star")
+        x, y = self.free_spot(RED_STAR_SIZE, avoid_star=True)
+
+        # Set red star properties
+        red_star = self.game_state.red_star
+        self.red_star_id += 1
+        red_star.active = True
+        red_star.x = x
+        red_star.y = y
+        red_star.clicks_by_player = {}
+        red_star.expires_at = time.time() + RED_STAR_DURATION
+
+        # Broadcast the updated game state
+        self.broadcast_game_state()
+
+        # Schedule the red star to disappear
+        disappear_timer = threading.Timer(RED_STAR_DURATION, self.remove_red_star)
+        disappear_timer.daemon = True
+        disappear_timer.start()
+
+    def remove_red_star(self):
+        with self.lock:
+            self.expire_red_star()
+
+    def expire_red_star(self):
+        red_star = self.game_state.red_star
+        if red_star.active:
+            print("[Server] 🔴 Red star disappeared (timeout)")
+            # Clicks stay until the next spawn; a lagged player may still finish on a star they can see
+            red_star.active = False
+            self.broadcast_game_state()
+
+        # Schedule the next red star
+        self.schedule_red_star()
+
+    def update_game_timer(self):
+        with self.lock:
+            self.count_down()
+
+    def count_down(self):
+        if not self.game_state.game_started:
+            return
+        self.game_state.time_remaining -= 1
+        current_time = time.time() * 1000
+        for player in self.game_state.players.values():
+            player.speed_boost = max(0, player.speed_boost)
+            player.speed_penalty = max(0, player.speed_penalty)
+        if self.game_state.time_remaining <= 0:
+            self.end_game()
+        else:
+            self.game_timer = threading.Timer(1.0, self.update_game_timer)
+            self.game_timer.daemon = True
+            self.game_timer.start()
+            self.broadcast_event({"type": "tick_time", "timeRemaining": self.game_state.time_remaining})
+
+    def end_game(self):
+        # Pickups claimed just before time ran out still count
+        self.settle_contests(force=True)
+        highest = -1
+        winner_id = None
+        for player in self.game_state.players.values():
+            if player.score > highest:
+                highest = player.score
+                winner_id = player.id
+        self.game_state.game_started = False
+        self.game_state.winner = winner_id
+
+        # Clear any active red star
+        self.game_state.red_star.active = False
+        if self.red_star_timer:
+            self.red_star_timer.cancel()
+
+        print(f"Match {self.match_id} ended. Winner: Player {winner_id}")
+        self.record_result()
+        # Same players go again unless enough of them leave
+        self.arm_auto_start(rematch=True)
+        self.broadcast_game_state()
+
+    def record_result(self):
+        history = self.server.history
+        if history is None:
+            return
+        players = []
+        for player in self.game_state.players.values():
+            stats = self.round_stats.get(player.id, {})
+            players.append({"slot": player.id, "name": self.names.get(player.id), "color": player.color,
+                            "score": player.score, "redStars": stats.get("redStars", 0),
+                            "powerups": stats.get("powerups", 0)})
+        # Only queued here; the history writer thread does the disk work
+        history.record_match({"matchId": self.match_id, "startedAt": self.round_started_at, "endedAt": time.time(),
+                              "winner": self.game_state.winner, "players": players})
+
+    def initialize_game_map(self):
+        # Layouts come ready-made from the server's MapPool, so a round starts without any sampling
+        layout = self.server.map_pool(self.settings).take()
+        self.game_state.obstacles = layout.obstacles
+        self.game_state.obstacle_payload = layout.obstacle_payload
+        self.game_state.powerups = layout.powerups()
+        self.obstacle_grid.clear()
+        for obstacle in layout.obstacles:
+            self.obstacle_grid.insert(obstacle, obstacle.x, obstacle.y)
+        self.max_obstacle_size = max((obstacle.size for obstacle in layout.obstacles), default=0)
+        self.powerup_grid.clear()
+        for powerup in self.game_state.powerups:
+            self.powerup_grid.insert(powerup, powerup.x, powerup.y)
+        print(f"Match {self.match_id} using map {layout.seed}")
+
+    @timed
+    def broadcast_game_state(self):
+        # Full snapshot: joins, round changes, red star spawns and every RESYNC_INTERVAL
+        self.last_snapshot_at = time.monotonic()
+        self.server.metrics.incr("broadcast.snapshots")
+        if self.interest:
+            if self.game_state.game_started:
+                self.broadcast_interest_views(full=True)
+                # Spectators aren't anywhere on the map; they always get the whole state
+                if self.feed.has_subscribers() or self.ring:
+                    self.publish_snapshot()
+                return
+            # Everyone sees the whole lobby; entities re-enter once the next round starts
+            self.interest.reset()
+
+        # Serialize and encode once for every client; only compression is per connection
+        payload = encode_message({"type": "game_state_update", "tick": self.tick_count,
+                                  "gameState": self.game_state.to_dict()})
+        self.publish(payload)
+        self.send_to_all(payload)
+
+    def publish_snapshot(self):
+        self.publish(encode_message({"type": "game_state_update", "tick": self.tick_count,
+                                     "gameState": self.game_state.to_dict()}))
+
+    def publish(self, payload):
+        # Full snapshots for spectators and local ring readers
+        self.feed.publish(payload)
+        if self.ring:
+            self.ring.publish(payload)
+        self.last_published_at = time.monotonic()
+        self.feed_stale = False
+
+    def broadcast_event(self, message, entities=None, moved_to=None):
+        # A discrete change, applied by clients on top of their last snapshot. With area of interest on,
+        # an event about entities only goes to clients whose view holds one of them.
+        self.server.metrics.incr(f"broadcast.{message['type']}")
+        message["tick"] = self.tick_count
+        self.feed_stale = True
+        if not (self.interest and entities and self.game_state.game_started):
+            self.send_to_all(encode_message(message))
+            return
+        viewers = self.interest.viewers(entities)
+        if moved_to is None:
+            self.send_to_all(encode_message(message), viewers)
+            return
+        # The entity moved to moved_to: only clients that can see the new spot get it, the rest just lose the entity
+        players = self.game_state.players
+        near = set()
+        for client_id in viewers:
+            connection = self.connections.get(client_id)
+            player = players.get(connection.player_id) if connection else None
+            if player is not None and self.interest.sees(player, *moved_to):
+                near.add(client_id)
+        self.send_to_all(encode_message(message), near)
+        if viewers - near:
+            self.send_to_all(encode_message({key: value for key, value in message.items() if key not in ("x", "y")}),
+                             viewers - near)
+
+    def broadcast_positions(self, player_ids):
+        if self.interest:
+            # Each client only hears about the players near them
+            self.broadcast_interest_views(player_ids)
+            self.feed_stale = True
+            return
+        players = self.game_state.players
+        self.broadcast_event({"type": "player_positions",
+                              "players": [[pid, players[pid].x, players[pid].y] for pid in player_ids]})
+
+    def send_to_all(self, payload, client_ids=None):
+        for client_id, connection in list(self.connections.items()):
+            if client_ids is not None and client_id not in client_ids:
+                continue
+            try:
+                connection.send_payload(payload)
+            except Exception as e:
+                print(f"Error sending to client {client_id}: {e}")
+                self.server.handle_client_disconnect(client_id)
+
+    @timed
+    def broadcast_interest_views(self, moved=(), full=False):
+        clients = list(self.connections.items())
+        viewers = [(client_id, connection.player_id) for client_id, connection in clients]
+        views = self.interest.compute_views(self.game_state, viewers, self.tick_count, moved, full)
+        for (client_id, connection), (_, payload) in zip(clients, views):
+            if payload is None:
+                continue
+            try:
+                connection.send_payload(payload)
+            except Exception as e:
+                print(f"Error sending to client {client_id}: {e}")
+                self.server.handle_client_disconnect(client_id)
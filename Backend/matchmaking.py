@@ -0,0 +1,85 @@
+# Matchmaking queue. Connections that have finished the handshake wait here,
+# without a reader thread, until a match has a free lobby slot or the server
+# has room for a new match. pump() runs on the game loop, so it only ever queues
+# frames; each connection's writer thread does the sending.
+import threading
+import time
+from collections import deque
+
+MAX_QUEUE = 256  # Connections beyond this are rejected outright
+QUEUE_STATUS_INTERVAL = 5  # Seconds between queue_status refreshes; a send fails once the writer found the socket dead
+
+
+class QueueTicket:
+    __slots__ = ("connection", "enqueued_at", "position")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.enqueued_at = time.time()
+        self.position = None  # Last position reported to the client
+
+
+class Matchmaker:
+    def __init__(self, server, max_queue=MAX_QUEUE):
+        self.server = server
+        self.metrics = server.metrics
+        self.max_queue = max_queue
+        self.queue = deque()
+        # All match creation, admission and removal happens under this lock
+        self.lock = threading.Lock()
+        self.last_status_at = 0
+
+    def enqueue(self, connection):
+        with self.lock:
+            if len(self.queue) >= self.max_queue:
+                self.metrics.incr("matchmaking.rejected")
+                return False
+            self.queue.append(QueueTicket(connection))
+            self.metrics.incr("matchmaking.enqueued")
+        self.pump()
+        return True
+
+    def pump(self):
+        # Admit queued connections into open lobbies, opening new matches while the server has room.
+        # Runs on the game loop: an error here is logged and retried next tick, never raised into the loop
+        with self.lock:
+            try:
+                self.admit()
+            except Exception as e:
+                print(f"Error admitting queued players: {e}")
+                self.metrics.incr("matchmaking.errors")
+
+    def admit(self):
+        # Called with self.lock held
+        self.server.reap_matches()
+        while self.queue:
+            match = self.server.find_open_match()
+            if match is None:
+                break
+            ticket = self.queue.popleft()
+            if self.server.start_session(ticket.connection, match):
+                self.metrics.incr("matchmaking.admitted")
+                self.metrics.observe("matchmaking.admission_latency_seconds", time.time() - ticket.enqueued_at)
+        self.report_positions()
+        self.metrics.set_gauge("matchmaking.queue_depth", len(self.queue))
+
+    def report_positions(self):
+        now = time.time()
+        refresh = now - self.last_status_at >= QUEUE_STATUS_INTERVAL
+        if refresh:
+            self.last_status_at = now
+        dead = []
+        for position, ticket in enumerate(self.queue, start=1):
+            if ticket.position == position and not refresh:
+                continue
+            try:
+                ticket.connection.send_message({"type": "queue_status", "position": position,
+                                                "queueLength": len(self.queue)})
+                ticket.position = position
+            except Exception as e:
+                print(f"Dropping queued connection {ticket.connection.address}: {e}")
+                dead.append(ticket)
+        for ticket in dead:
+            self.queue.remove(ticket)
+            ticket.connection.close()
+            self.metrics.incr("matchmaking.abandoned")
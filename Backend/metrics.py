@@ -0,0 +1,63 @@
+# In-process metrics: counters, gauges and sampled distributions.
+# The server exposes snapshot() through the get_metrics message.
+import threading
+from collections import deque
+
+SAMPLE_WINDOW = 1024  # Most recent observations kept per distribution for percentiles
+
+
+class Distribution:
+    __slots__ = ("count", "total", "min", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.samples.append(value)
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def to_dict(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count else None,
+                "min": self.min, "max": self.max,
+                "p50": self.percentile(0.5), "p95": self.percentile(0.95), "p99": self.percentile(0.99)}
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.distributions = {}
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self.lock:
+            distribution = self.distributions.get(name)
+            if distribution is None:
+                distribution = self.distributions[name] = Distribution()
+            distribution.observe(value)
+
+    def snapshot(self):
+        with self.lock:
+            return {"counters": dict(self.counters), "gauges": dict(self.gauges),
+                    "distributions": {name: d.to_dict() for name, d in self.distributions.items()}}
@@ -0,0 +1,196 @@
+# Game state model shared by the server and the client mirror.
+# Every entity uses __slots__ and players are keyed by their integer id.
+# to_dict()/from_dict() convert to and from the JSON wire format, which keeps
+# the original camelCase keys so the protocol is unchanged.
+
+
+class Player:
+    __slots__ = ("id", "x", "y", "speed", "score", "color", "has_object", "speed_boost", "speed_penalty", "connected")
+
+    def __init__(self, player_id, x, y, speed, color, score=0, has_object=False, speed_boost=0, speed_penalty=0,
+                 connected=True):
+        self.id = player_id
+        self.x = x
+        self.y = y
+        self.speed = speed
+        self.score = score
+        self.color = color
+        self.has_object = has_object
+        # Expiry timestamps (ms) of the active powerup effects, 0 when inactive
+        self.speed_boost = speed_boost
+        self.speed_penalty = speed_penalty
+        # False while the server holds the slot for a player who dropped and may resume
+        self.connected = connected
+
+    def to_dict(self):
+        return {"id": self.id, "x": self.x, "y": self.y, "speed": self.speed, "score": self.score,
+                "color": self.color, "hasObject": self.has_object,
+                "powerups": {"speedBoost": self.speed_boost, "speedPenalty": self.speed_penalty},
+                "connected": self.connected}
+
+    @classmethod
+    def from_dict(cls, data):
+        powerups = data.get("powerups", {})
+        return cls(data["id"], data["x"], data["y"], data.get("speed", 0), data.get("color", "red"),
+                   data.get("score", 0), data.get("hasObject", False),
+                   powerups.get("speedBoost", 0), powerups.get("speedPenalty", 0), data.get("connected", True))
+
+
+class Obstacle:
+    __slots__ = ("x", "y", "size", "type")
+
+    def __init__(self, x, y, size, obstacle_type="ice"):
+        self.x = x
+        self.y = y
+        self.size = size
+        self.type = obstacle_type
+
+    def to_dict(self):
+        return {"x": self.x, "y": self.y, "size": self.size, "type": self.type}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["x"], data["y"], data["size"], data.get("type", "ice"))
+
+
+class Powerup:
+    __slots__ = ("id", "x", "y", "type", "active")
+
+    def __init__(self, powerup_id, x, y, powerup_type, active=True):
+        self.id = powerup_id
+        self.x = x
+        self.y = y
+        self.type = powerup_type
+        self.active = active
+
+    def to_dict(self):
+        return {"id": self.id, "x": self.x, "y": self.y, "type": self.type, "active": self.active}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("id"), data["x"], data["y"], data["type"], data.get("active", True))
+
+
+class SharedObject:
+    __slots__ = ("x", "y", "is_held", "holder_id")
+
+    def __init__(self, x, y, is_held=False, holder_id=None):
+        self.x = x
+        self.y = y
+        self.is_held = is_held
+        self.holder_id = holder_id
+
+    def to_dict(self):
+        return {"x": self.x, "y": self.y, "isHeld": self.is_held, "holderId": self.holder_id}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("x", 0), data.get("y", 0), data.get("isHeld", False), data.get("holderId"))
+
+
+class RedStar:
+    __slots__ = ("active", "x", "y", "clicks_required", "clicks_by_player", "expires_at")
+
+    def __init__(self, clicks_required, active=False, x=0, y=0, clicks_by_player=None, expires_at=0):
+        self.active = active
+        self.x = x
+        self.y = y
+        self.clicks_required = clicks_required
+        # player id (int) -> clicks so far
+        self.clicks_by_player = clicks_by_player if clicks_by_player is not None else {}
+        # Server wall clock time when the red star disappears
+        self.expires_at = expires_at
+
+    def to_dict(self):
+        # JSON object keys must be strings
+        return {"active": self.active, "x": self.x, "y": self.y, "clicksRequired": self.clicks_required,
+                "clicksByPlayer": {str(pid): clicks for pid, clicks in self.clicks_by_player.items()},
+                "expiresAt": self.expires_at}
+
+    @classmethod
+    def from_dict(cls, data):
+        clicks = {int(pid): count for pid, count in data.get("clicksByPlayer", {}).items()}
+        return cls(data.get("clicksRequired", 0), data.get("active", False), data.get("x", 0), data.get("y", 0),
+                   clicks, data.get("expiresAt", 0))
+
+
+class GameState:
+    __slots__ = ("match_id", "players", "shared_object", "obstacles", "obstacle_payload", "powerups", "time_remaining",
+                 "game_started", "winner", "red_star", "starts_at", "arena_size", "max_players")
+
+    def __init__(self, shared_object, red_star, time_remaining):
+        self.match_id = None
+        self.players = {}  # player_id: Player, in join order
+        # None on clients when the star is outside their area of interest
+        self.shared_object = shared_object
+        self.obstacles = []
+        # Serialized obstacles from the map layout; reset to None whenever obstacles is replaced some other way
+        self.obstacle_payload = None
+        self.powerups = []
+        self.time_remaining = time_remaining
+        self.game_started = False
+        self.winner = None
+        self.red_star = red_star
+        # Server wall clock time when the lobby starts on its own, None when no start is scheduled
+        self.starts_at = None
+        # From the match's settings; None from servers that predate them (a 700px arena for 4)
+        self.arena_size = None
+        self.max_players = None
+
+    def to_dict(self):
+        return {
+            "matchId": self.match_id,
+            "players": [player.to_dict() for player in self.players.values()],
+            "sharedObject": self.shared_object.to_dict() if self.shared_object else None,
+            "obstacles": self.obstacle_payload if self.obstacle_payload is not None else
+            [obstacle.to_dict() for obstacle in self.obstacles],
+            "powerups": [powerup.to_dict() for powerup in self.powerups],
+            "timeRemaining": self.time_remaining,
+            "gameStarted": self.game_started,
+            "winner": self.winner,
+            "redStar": self.red_star.to_dict(),
+            "startsAt": self.starts_at,
+            "arenaSize": self.arena_size,
+            "maxPlayers": self.max_players,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        shared_object = data.get("sharedObject")
+        state = cls(SharedObject.from_dict(shared_object) if shared_object else None,
+                    RedStar.from_dict(data.get("redStar", {})), data.get("timeRemaining", 0))
+        for player_data in data.get("players", []):
+            player = Player.from_dict(player_data)
+            state.players[player.id] = player
+        state.obstacles = [Obstacle.from_dict(o) for o in data.get("obstacles", [])]
+        state.powerups = [Powerup.from_dict(p) for p in data.get("powerups", [])]
+        state.game_started = data.get("gameStarted", False)
+        state.winner = data.get("winner")
+        state.match_id = data.get("matchId")
+        state.starts_at = data.get("startsAt")
+        state.arena_size = data.get("arenaSize")
+        state.max_players = data.get("maxPlayers")
+        return state
+
+    # Area-of-interest enter/leave events, see interest.py
+    def add_entity(self, kind, data):
+        if kind == "player":
+            player = Player.from_dict(data)
+            self.players[player.id] = player
+        elif kind == "powerup":
+            powerup = Powerup.from_dict(data)
+            self.powerups = [p for p in self.powerups if p.id != powerup.id] + [powerup]
+        elif kind == "sharedObject":
+            self.shared_object = SharedObject.from_dict(data)
+        elif kind == "redStar":
+            self.red_star = RedStar.from_dict(data)
+
+    def remove_entity(self, kind, entity_id):
+        if kind == "player":
+            self.players.pop(entity_id, None)
+        elif kind == "powerup":
+            self.powerups = [p for p in self.powerups if p.id != entity_id]
+        elif kind == "sharedObject":
+            self.shared_object = None
+        elif kind == "redStar":
+            self.red_star.active = False
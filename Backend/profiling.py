@@ -0,0 +1,134 @@
+# Built-in profiler for the server, switched on and off at runtime (SIGUSR1 or
+# the admin message). While it runs, a sampler thread records the stack of every
+# other thread at a fixed rate and functions decorated with @timed record how long
+# each call takes. Stopping writes the stacks in collapsed format, one
+# "frame;frame;frame count" line per distinct stack, which flamegraph.pl and
+# speedscope read directly, plus a JSON summary of the timings.
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from metrics import Distribution
+
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples (200 Hz)
+PROFILE_DIR = "profiles"
+
+timings_enabled = False  # Checked by every @timed call; only timed while a profile runs
+timings = {}  # qualified function name: Distribution of call times in microseconds
+timings_lock = threading.Lock()
+
+
+def timed(func):
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not timings_enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1e6
+            with timings_lock:
+                distribution = timings.get(name)
+                if distribution is None:
+                    distribution = timings[name] = Distribution()
+                distribution.observe(elapsed)
+    return wrapper
+
+
+def frame_label(code):
+    # Keyed on the function's first line so every sample of a function folds together
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def collapse(frame, thread_name):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(thread_name.replace(";", ":"))
+    labels.reverse()
+    return ";".join(labels)
+
+
+class SamplingProfiler:
+    def __init__(self, interval=SAMPLE_INTERVAL, output_dir=PROFILE_DIR):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+
+    def start(self):
+        global timings_enabled
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            with timings_lock:
+                timings.clear()
+            timings_enabled = True
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name="profiler")
+            self.thread.daemon = True
+            self.thread.start()
+        print(f"Profiler started ({1 / self.interval:.0f} Hz)")
+        return True
+
+    def run(self):
+        me = threading.get_ident()
+        while self.running:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident != me:
+                    self.stacks[collapse(frame, names.get(ident, f"thread-{ident}"))] += 1
+            # Don't keep the sampled threads' frames alive until the next sample
+            frames = frame = None
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def stop(self):
+        # Returns a summary of the run, including where the profile was written
+        global timings_enabled
+        with self.lock:
+            if not self.running:
+                return None
+            self.running = False
+            timings_enabled = False
+            self.thread.join()
+            summary = self.dump()
+        print(f"Profiler stopped: {summary['samples']} samples written to {summary['stacks']}")
+        return summary
+
+    def toggle(self):
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+    def dump(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"server-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}")
+        with open(base + ".folded", "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with timings_lock:
+            timing_summary = {name: dict(distribution.to_dict(), total=distribution.total)
+                              for name, distribution in timings.items()}
+        summary = {"stacks": base + ".folded", "timingsFile": base + ".timings.json", "samples": self.samples,
+                   "seconds": time.time() - self.started_at, "timingsMicros": timing_summary}
+        with open(base + ".timings.json", "w") as f:
+            json.dump(summary, f, indent=2)
+        return summary
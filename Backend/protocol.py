@@ -0,0 +1,170 @@
+# Wire protocol helpers shared by the server and the client.
+# Every message is a JSON document in a frame prefixed by its 4-byte big-endian
+# length. After the handshake the server may compress the payloads it sends
+# inside those frames with a zlib stream that lives as long as the connection.
+import json
+import struct
+import time
+import zlib
+
+from models import GameState, Player, Obstacle, Powerup, SharedObject, RedStar
+from profiling import timed
+
+HEADER_SIZE = 4
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # Upper bound for a single payload; larger headers mean a broken peer
+READ_BUFFER_SIZE = 64 * 1024
+
+# Compression modes in order of preference
+COMPRESSION_MODES = ["zlib-dict", "zlib"]
+COMPRESSION_LEVEL = 6
+
+
+def encode_message(message):
+    return json.dumps(message).encode('utf-8')
+
+
+def encode_frame(payload):
+    return len(payload).to_bytes(HEADER_SIZE, byteorder='big') + payload
+
+
+def decode_message(payload):
+    # Accepts bytes or a memoryview from FrameReader; str() decodes straight from the buffer
+    return json.loads(str(payload, 'utf-8'))
+
+
+class FrameError(Exception):
+    pass
+
+
+class FrameReader:
+    # Reads length-prefixed frames with recv_into into one growable buffer, so a
+    # single syscall can deliver many frames and no payload is copied on the way.
+    def __init__(self, sock, max_frame_size=MAX_FRAME_SIZE, buffer_size=READ_BUFFER_SIZE):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray(buffer_size)
+        self.start = 0  # First byte not yet handed out
+        self.end = 0  # End of the bytes received so far
+        self.frames_read = 0
+        self.recv_calls = 0
+
+    def frames(self):
+        # Yields each payload as a memoryview into the buffer. It is only valid
+        # until the next frame is requested, so decode it before moving on.
+        while True:
+            while self.end - self.start >= HEADER_SIZE:
+                length = HEADER.unpack_from(self.buffer, self.start)[0]
+                if length > self.max_frame_size:
+                    raise FrameError(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+                frame_end = self.start + HEADER_SIZE + length
+                if frame_end > self.end:
+                    break
+                payload = memoryview(self.buffer)[self.start + HEADER_SIZE:frame_end]
+                self.start = frame_end
+                self.frames_read += 1
+                try:
+                    yield payload
+                finally:
+                    # The buffer can't be resized while a view of it is alive
+                    payload.release()
+            if not self.fill():
+                return
+
+    @timed
+    def fill(self):
+        pending = self.end - self.start
+        if pending == 0:
+            self.start = self.end = 0
+        needed = HEADER_SIZE
+        if pending >= HEADER_SIZE:
+            needed += HEADER.unpack_from(self.buffer, self.start)[0]
+        # Slide the partial frame to the front when it can't complete in the space left
+        if self.start and self.start + needed > len(self.buffer):
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        if needed > len(self.buffer):
+            self.buffer.extend(bytes(max(needed, len(self.buffer) * 2) - len(self.buffer)))
+        tail = memoryview(self.buffer)[self.end:]
+        try:
+            received = self.sock.recv_into(tail)
+        finally:
+            tail.release()
+        self.recv_calls += 1
+        if not received:
+            return False
+        self.end += received
+        return True
+
+
+def choose_compression(offered, supported=COMPRESSION_MODES):
+    # Pick the first of our modes the peer offered
+    for mode in supported:
+        if mode in (offered or []):
+            return mode
+    return None
+
+
+def build_preset_dictionary():
+    # zlib looks back for matches in the preset dictionary, so a game_state_update
+    # with every key name we send makes even the first frame of a connection
+    # compress well. Content that is most likely to repeat goes last.
+    state = GameState(SharedObject(340.0, 340.0), RedStar(5), 120)
+    state.players = {pid: Player(pid, 10, 10, 5, color) for pid, color in
+                     enumerate(["red", "purple", "blue", "green"], start=1)}
+    state.obstacles = [Obstacle(100.0, 200.0, 60, "ice")]
+    state.powerups = [Powerup(0, 50.0, 60.0, "speed"), Powerup(1, 70.0, 80.0, "slow")]
+    state.game_started = True
+    return encode_message({"type": "game_state_update", "gameState": state.to_dict()})
+
+
+PRESET_DICTIONARY = build_preset_dictionary()
+
+
+class FrameCompressor:
+    def __init__(self, mode, level=COMPRESSION_LEVEL):
+        self.mode = mode
+        if mode == "zlib-dict":
+            self.stream = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=PRESET_DICTIONARY)
+        else:
+            self.stream = zlib.compressobj(level)
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.cpu_time = 0.0
+
+    @timed
+    def compress(self, payload):
+        start = time.thread_time()
+        # A sync flush ends each frame on a byte boundary without resetting the stream,
+        # so later frames still reference earlier ones
+        data = self.stream.compress(payload) + self.stream.flush(zlib.Z_SYNC_FLUSH)
+        self.cpu_time += time.thread_time() - start
+        self.raw_bytes += len(payload)
+        self.compressed_bytes += len(data)
+        return data
+
+    def ratio(self):
+        return self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 0.0
+
+
+class FrameDecompressor:
+    def __init__(self, mode):
+        self.mode = mode
+        if mode == "zlib-dict":
+            self.stream = zlib.decompressobj(zlib.MAX_WBITS, zdict=PRESET_DICTIONARY)
+        else:
+            self.stream = zlib.decompressobj()
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.cpu_time = 0.0
+
+    def decompress(self, payload):
+        start = time.thread_time()
+        data = self.stream.decompress(payload)
+        self.cpu_time += time.thread_time() - start
+        self.compressed_bytes += len(payload)
+        self.raw_bytes += len(data)
+        return data
+
+    def ratio(self):
+        return self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 0.0
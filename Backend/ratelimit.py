@@ -0,0 +1,23 @@
+# Token bucket used to cap how fast a single connection can make the server work.
+import time
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated_at", "dropped")
+
+    def __init__(self, rate, burst):
+        self.rate = rate  # Tokens added per second
+        self.burst = burst  # Most tokens the bucket holds
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.dropped = 0
+
+    def allow(self, cost=1):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        self.dropped += 1
+        return False
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# Spectator relay. Subscribes once to a match's snapshot stream (on the game
+# server or on another relay) and fans the already-encoded frames out to any
+# number of read-only viewers, optionally delayed and at a reduced rate.
+# Relays speak the same spectator protocol upstream and downstream, so they chain:
+#
+#   python relay.py --upstream-port 5001 --port 6001 --delay 2
+#   python relay.py --upstream-port 6001 --port 6002 --max-rate 10
+import argparse
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+from protocol import FrameReader, decode_message, encode_frame, encode_message
+from spectator import spectate_accepted_frame
+
+MAX_VIEWER_BACKLOG = 1024 * 1024  # Bytes queued for one viewer before its older frames are skipped
+UPSTREAM_RETRY_DELAY = 2  # Seconds between attempts to (re)subscribe upstream
+
+
+class Viewer:
+    __slots__ = ("socket", "address", "frames", "offset", "backlog")
+
+    def __init__(self, sock, address):
+        self.socket = sock
+        self.address = address
+        self.frames = deque()
+        self.offset = 0  # Bytes of frames[0] already sent
+        self.backlog = 0
+
+    def queue_frame(self, frame):
+        if self.backlog > MAX_VIEWER_BACKLOG:
+            # Frames are full snapshots: keep the one being written, skip the rest
+            head = self.frames.popleft() if self.offset else None
+            self.frames.clear()
+            self.backlog = 0
+            if head is not None:
+                self.frames.append(head)
+                self.backlog = len(head) - self.offset
+        self.frames.append(frame)
+        self.backlog += len(frame)
+
+    def flush(self):
+        while self.frames:
+            frame = self.frames[0]
+            sent = self.socket.send(memoryview(frame)[self.offset:])
+            self.offset += sent
+            self.backlog -= sent
+            if self.offset < len(frame):
+                return False
+            self.frames.popleft()
+            self.offset = 0
+        return True
+
+
+class SpectatorRelay:
+    def __init__(self, upstream_host, upstream_port, host='0.0.0.0', port=6001, match_id=None, delay=0.0,
+                 max_rate=None):
+        self.upstream = (upstream_host, upstream_port)
+        self.host = host
+        self.port = port
+        self.match_id = match_id
+        self.delay = delay
+        self.min_interval = 1.0 / max_rate if max_rate else 0.0
+        self.pending = deque()  # (release_at, frame) received from upstream
+        self.pending_lock = threading.Lock()
+        self.latest = None  # Newest released frame, sent first to new viewers
+        self.last_forward_at = 0.0
+        self.viewers = {}  # socket: Viewer
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.frames_in = 0
+        self.frames_out = 0
+
+    def start(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(128)
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, "accept")
+        self.wakeup_reader.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, "wakeup")
+        print(f"Relay listening on {self.host}:{self.port}, upstream {self.upstream[0]}:{self.upstream[1]}")
+        upstream_thread = threading.Thread(target=self.follow_upstream)
+        upstream_thread.daemon = True
+        upstream_thread.start()
+        self.fan_out(listener)
+
+    def follow_upstream(self):
+        while True:
+            try:
+                sock = socket.create_connection(self.upstream)
+                hello = {"type": "hello", "role": "spectator", "matchId": self.match_id}
+                sock.sendall(encode_frame(encode_message(hello)))
+                frames = FrameReader(sock).frames()
+                # The first frame is upstream's spectate_accepted; viewers get ours instead
+                reply = next(frames, None)
+                reply = decode_message(reply) if reply is not None else {}
+                if reply.get("type") != "spectate_accepted":
+                    raise ConnectionError(reply.get("message", "upstream closed during the handshake"))
+                print("Subscribed upstream")
+                for payload in frames:
+                    # The one copy per frame: our own framed bytes, shared by every viewer
+                    frame = encode_frame(bytes(payload))
+                    with self.pending_lock:
+                        self.pending.append((time.time() + self.delay, frame))
+                    self.frames_in += 1
+                    self.wakeup_writer.send(b'\0')
+                print("Upstream closed the feed")
+            except Exception as e:
+                print(f"Upstream error: {e}")
+            time.sleep(UPSTREAM_RETRY_DELAY)
+
+    def fan_out(self, listener):
+        while True:
+            for key, events in self.selector.select(self.next_timeout()):
+                if key.data == "accept":
+                    self.accept_viewer(listener)
+                elif key.data == "wakeup":
+                    try:
+                        self.wakeup_reader.recv(4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    self.service_viewer(key.data, events)
+            self.release_frames()
+
+    def next_timeout(self):
+        with self.pending_lock:
+            if not self.pending:
+                return None
+            release_at = self.pending[0][0]
+        return max(0.0, max(release_at, self.last_forward_at + self.min_interval) - time.time())
+
+    def release_frames(self):
+        now = time.time()
+        frame = None
+        with self.pending_lock:
+            if now - self.last_forward_at < self.min_interval:
+                return
+            if self.min_interval:
+                # Reduced rate: forward only the newest due snapshot
+                while self.pending and self.pending[0][0] <= now:
+                    frame = self.pending.popleft()[1]
+                due = [frame] if frame else []
+            else:
+                due = []
+                while self.pending and self.pending[0][0] <= now:
+                    due.append(self.pending.popleft()[1])
+        if not due:
+            return
+        self.last_forward_at = now
+        self.latest = due[-1]
+        for viewer in list(self.viewers.values()):
+            for frame in due:
+                viewer.queue_frame(frame)
+            self.frames_out += len(due)
+            self.write_viewer(viewer)
+
+    def accept_viewer(self, listener):
+        try:
+            sock, address = listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        viewer = Viewer(sock, address)
+        viewer.queue_frame(spectate_accepted_frame(self.match_id, relay=True))
+        if self.latest:
+            viewer.queue_frame(self.latest)
+        self.viewers[sock] = viewer
+        self.selector.register(sock, selectors.EVENT_READ, viewer)
+        self.write_viewer(viewer)
+        print(f"Viewer {address} joined ({len(self.viewers)} watching)")
+
+    def service_viewer(self, viewer, events):
+        if events & selectors.EVENT_READ:
+            # Viewers only ever send their hello; anything read is discarded, EOF means they left
+            try:
+                if not viewer.socket.recv(4096):
+                    self.drop_viewer(viewer)
+                    return
+            except BlockingIOError:
+                pass
+            except OSError:
+                self.drop_viewer(viewer)
+                return
+        if events & selectors.EVENT_WRITE:
+            self.write_viewer(viewer)
+
+    def write_viewer(self, viewer):
+        try:
+            done = viewer.flush()
+        except BlockingIOError:
+            done = False
+        except OSError:
+            self.drop_viewer(viewer)
+            return
+        events = selectors.EVENT_READ if done else selectors.EVENT_READ | selectors.EVENT_WRITE
+        self.selector.modify(viewer.socket, events, viewer)
+
+    def drop_viewer(self, viewer):
+        if self.viewers.pop(viewer.socket, None) is None:
+            return
+        self.selector.unregister(viewer.socket)
+        viewer.socket.close()
+        print(f"Viewer {viewer.address} left ({len(self.viewers)} watching)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spectator relay for Capture The Star")
+    parser.add_argument("--upstream-host", default="localhost")
+    parser.add_argument("--upstream-port", type=int, default=5001)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=6001)
+    parser.add_argument("--match", type=int, default=None, help="match to follow; defaults to the oldest running")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to hold frames back")
+    parser.add_argument("--max-rate", type=float, default=None, help="frames per second sent to viewers")
+    args = parser.parse_args()
+    SpectatorRelay(args.upstream_host, args.upstream_port, args.host, args.port, args.match, args.delay,
+                   args.max_rate).start()
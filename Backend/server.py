@@ -1,66 +1,189 @@
 #!/usr/bin/env python3
+import argparse
+import hmac
+import os
+import queue
+import signal
 import socket
 import threading
-import json
 import time
-import random
-import math
-
-# Game Constants
-CANVAS_SIZE = 700
-PLAYER_SIZE = 30
-OBJECT_SIZE = 20
-POWERUP_SIZE = 15
-RED_STAR_SIZE = 25  # Size of the special red star
-GAME_DURATION = 120
-BASE_SPEED = 5
-SPEED_BOOST = 3
-SPEED_PENALTY = 2
-NUM_OBSTACLES = 18
-NUM_POWERUPS = 4
-MAX_PLAYERS = 4
-RED_STAR_POINTS = 5  # Points awarded for collecting the red star
-RED_STAR_CLICKS_REQUIRED = 5  # Clicks required to collect the red star
-RED_STAR_DURATION = 5  # Duration in seconds that the red star stays on screen
-RED_STAR_MIN_INTERVAL = 15  # Minimum seconds between red star appearances
-RED_STAR_MAX_INTERVAL = 30  # Maximum seconds between red star appearances
-
-STARTING_POSITIONS = [
-    {"x": 10, "y": 10, "color": "red"},
-    {"x": CANVAS_SIZE - PLAYER_SIZE - 10, "y": CANVAS_SIZE - PLAYER_SIZE - 10, "color": "purple"},
-    {"x": 10, "y": CANVAS_SIZE - PLAYER_SIZE - 10, "color": "blue"},
-    {"x": CANVAS_SIZE - PLAYER_SIZE - 10, "y": 10, "color": "green"}
-]
+import itertools
+from collections import deque
+
+from history import HISTORY_DB, LEADERBOARD_SIZE, HistoryStore
+from mapgen import MapPool
+from match import Match, MatchSettings, INTEREST_RADIUS, MAX_PLAYERS
+from matchmaking import Matchmaker
+from metrics import Metrics
+from profiling import SamplingProfiler
+from ratelimit import TokenBucket
+from protocol import FrameCompressor, FrameReader, choose_compression, decode_message, encode_frame, encode_message
+
+# Server Constants
+HANDSHAKE_TIMEOUT = 5  # Seconds a new connection has to send its hello
+MAX_CLIENT_FRAME_SIZE = 64 * 1024  # Client messages are tiny; anything bigger is dropped with the connection
+MAX_MATCHES = 16  # Matches running at once; further players wait in the matchmaking queue
+MAX_NAME_LENGTH = 24
+TICK_INTERVAL = 0.01  # Seconds between server ticks
+PING_INTERVAL = 1.0  # Seconds between pings to each player
+RTT_SMOOTHING = 0.125  # Weight of a new sample in the smoothed RTT
+CLOCK_SAMPLES = 8  # Recent pongs the clock offset is picked from
+INPUT_RATE = 30  # Messages per second a client may send; direction changes, input refreshes and clicks fit well under
+INPUT_BURST = 30
+UNLIMITED_MESSAGES = ("pong", "leave")  # Never rate limited: RTT measurement and a clean exit must get through
+SEND_BACKLOG = 240  # Frames queued for a client, about four seconds of per-tick updates; one further behind is cut off
+ADMIN_TOKEN = os.environ.get("GAME_ADMIN_TOKEN")  # Unset disables the admin message
+SNAPSHOT_RING_DIR = os.environ.get("GAME_SNAPSHOT_RING_DIR")  # e.g. /dev/shm/capture-the-star; unset disables rings
+
+
+def query_limit(message):
+    # A malformed limit gets the default rather than dropping the connection; history.py clamps the rest
+    try:
+        return int(message.get("limit", LEADERBOARD_SIZE))
+    except (TypeError, ValueError, OverflowError):
+        # OverflowError: JSON allows Infinity, which int() can't convert
+        return LEADERBOARD_SIZE
+
+
+class ClientConnection:
+    __slots__ = ("client_id", "socket", "address", "reader", "player_id", "match", "name", "compression_mode",
+                 "compressor", "send_lock", "outbox", "writer", "closed", "input_bucket", "ping_seq", "rtt", "rtt_var",
+                 "clock_offset", "clock_samples")
+
+    def __init__(self, client_id, client_socket, address, reader):
+        self.client_id = client_id
+        self.socket = client_socket
+        self.address = address
+        self.reader = reader  # FrameReader; may already hold frames sent right after the hello
+        self.player_id = None
+        self.match = None
+        self.name = None  # Optional name from the hello; named players get history and a leaderboard entry
+        self.compression_mode = None  # Negotiated in the hello, switched on by connection_accepted
+        self.compressor = None  # FrameCompressor once compression is active
+        # Broadcasts come from several threads; frames (and the compression stream) must not interleave
+        self.send_lock = threading.Lock()
+        # Frames waiting for the writer thread, which does the blocking sends; started by the first send
+        self.outbox = queue.Queue(maxsize=SEND_BACKLOG)
+        self.writer = None
+        self.closed = False
+        self.input_bucket = TokenBucket(INPUT_RATE, INPUT_BURST)
+        self.ping_seq = 0
+        self.rtt = None  # Smoothed round-trip time in seconds
+        self.rtt_var = 0.0
+        self.clock_offset = None  # Client clock minus server clock, in seconds
+        self.clock_samples = deque(maxlen=CLOCK_SAMPLES)  # (rtt, offset) of recent pongs
+
+    def record_pong(self, server_time, client_time, now):
+        rtt = now - server_time
+        if rtt < 0:
+            return None
+        if self.rtt is None:
+            self.rtt, self.rtt_var = rtt, rtt / 2
+        else:
+            self.rtt_var += RTT_SMOOTHING * (abs(rtt - self.rtt) - self.rtt_var)
+            self.rtt += RTT_SMOOTHING * (rtt - self.rtt)
+        # The client stamped the ping on arrival, about half a round trip after we sent it. The sample
+        # with the shortest round trip has the least room for asymmetric delay, so it sets the offset.
+        self.clock_samples.append((rtt, client_time - (server_time + rtt / 2)))
+        self.clock_offset = min(self.clock_samples)[1]
+        return rtt
+
+    def enable_compression(self):
+        if self.compression_mode:
+            self.compressor = FrameCompressor(self.compression_mode)
+
+    def send_payload(self, payload):
+        # Only queues the frame, so the game loop and the matchmaker never wait on a client's socket
+        with self.send_lock:
+            if self.closed:
+                raise ConnectionError("connection is closed")
+            if self.compressor:
+                payload = self.compressor.compress(payload)
+            try:
+                self.outbox.put_nowait(encode_frame(payload))
+            except queue.Full:
+                # Movement goes out every tick; a client that stopped reading must not hold the backlog forever
+                self.abort()
+                raise ConnectionError(f"client fell {SEND_BACKLOG} frames behind")
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.write_frames, name=f"writer-{self.client_id}")
+                self.writer.daemon = True
+                self.writer.start()
+
+    def send_message(self, message):
+        self.send_payload(encode_message(message))
+
+    def write_frames(self):
+        try:
+            while True:
+                frame = self.outbox.get()
+                if frame is None:
+                    break
+                self.socket.sendall(frame)
+        except OSError as e:
+            print(f"Error sending to client {self.client_id}: {e}")
+        finally:
+            self.closed = True
+            self.close_socket()
+
+    def close(self):
+        # Frames already queued (a rejection, say) still go out before the socket closes
+        with self.send_lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.writer is None:
+                self.close_socket()
+                return
+            try:
+                self.outbox.put_nowait(None)
+            except queue.Full:
+                self.abort()
+
+    def abort(self):
+        # Drop whatever is queued; shutting the socket down also fails a sendall the writer is stuck in
+        self.closed = True
+        self.close_socket()
+        try:
+            self.outbox.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def close_socket(self):
+        # shutdown wakes the client thread if it is blocked reading this socket
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.socket.close()
+        except:
+            pass
 
 
 class GameServer:
-    def __init__(self, host='0.0.0.0', port=5001):
+    def __init__(self, host='0.0.0.0', port=5001, interest_radius=INTEREST_RADIUS, compression=True,
+                 max_matches=MAX_MATCHES, history_path=HISTORY_DB, ring_dir=SNAPSHOT_RING_DIR, settings=None):
         self.host = host
         self.port = port
         self.server_socket = None
-        self.clients = {}  # client_id: (socket, address, player_id)
-        self.next_player_id = 1
-
-        self.game_state = {
-            "players": [],
-            "sharedObject": {"x": CANVAS_SIZE / 2 - OBJECT_SIZE / 2, "y": CANVAS_SIZE / 2 - OBJECT_SIZE / 2,
-                             "isHeld": False, "holderId": None},
-            "obstacles": [],
-            "powerups": [],
-            "timeRemaining": GAME_DURATION,
-            "gameStarted": False,
-            "winner": None,
-            "redStar": {
-                "active": False,
-                "x": 0,
-                "y": 0,
-                "clicksRequired": RED_STAR_CLICKS_REQUIRED,
-                "clicksByPlayer": {},  # Track clicks by each player
-                "expiresAt": 0  # Time when the red star will disappear
-            }
-        }
-        self.game_timer = None
-        self.red_star_timer = None
+        self.clients = {}  # client_id: ClientConnection of a player in a match
+        self.client_ids = itertools.count(1)
+        self.matches = {}  # match_id: Match
+        self.match_ids = itertools.count(1)
+        self.max_matches = max_matches
+        self.interest_radius = interest_radius
+        self.compression = compression
+        self.ring_dir = ring_dir  # Where each match publishes its snapshot ring, see snapshot_ring.py
+        self.metrics = Metrics()
+        self.history = HistoryStore(history_path, self.metrics) if history_path else None
+        self.matchmaker = Matchmaker(self)
+        self.match_settings = settings or MatchSettings()  # Arena size and player count of new matches
+        self.map_pools = {}  # MatchSettings.key(): MapPool
+        self.map_pools_lock = threading.Lock()
+        self.map_pool(self.match_settings)
+        self.last_ping_at = 0
+        self.profiler = SamplingProfiler()
 
     def start_server(self):
         try:
@@ -69,7 +192,10 @@ class GameServer:
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(5)
             print(f"Server started on {self.host}:{self.port}")
-            game_thread = threading.Thread(target=self.game_loop)
+            # kill -USR1 <pid> starts a profile; the second one stops it and writes it out
+            if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGUSR1, lambda signum, frame: self.profiler.toggle())
+            game_thread = threading.Thread(target=self.game_loop, name="game-loop")
             game_thread.daemon = True
             game_thread.start()
             self.accept_connections()
@@ -80,16 +206,13 @@ class GameServer:
 
     def shutdown_server(self):
         print("Shutting down server...")
-        if self.game_timer:
-            self.game_timer.cancel()
-        if self.red_star_timer:
-            self.red_star_timer.cancel()
-        for _, (client_socket, _, _) in list(self.clients.items()):
-            try:
-                client_socket.close()
-            except:
-                pass
+        for match in list(self.matches.values()):
+            match.shutdown()
+        for connection in list(self.clients.values()):
+            connection.close()
         self.clients.clear()
+        if self.history:
+            self.history.close()
         if self.server_socket:
             try:
                 self.server_socket.close()
@@ -102,502 +225,287 @@ class GameServer:
             while True:
                 client_socket, address = self.server_socket.accept()
                 print(f"New connection from {address}")
-                if len(self.game_state["players"]) >= MAX_PLAYERS:
-                    self.send_message_to_client(client_socket,
-                                                {"type": "connection_rejected", "message": "Game is full"})
-                    client_socket.close()
-                    continue
-                client_id = len(self.clients) + 1
-                player_id = self.next_player_id
-                self.next_player_id += 1
-                position = STARTING_POSITIONS[player_id - 1]
-                new_player = {"id": player_id, "x": position["x"], "y": position["y"], "speed": BASE_SPEED, "score": 0,
-                              "color": position["color"], "hasObject": False,
-                              "powerups": {"speedBoost": 0, "speedPenalty": 0}}
-                self.game_state["players"].append(new_player)
-                self.clients[client_id] = (client_socket, address, player_id)
-                self.send_message_to_client(client_socket, {"type": "connection_accepted", "playerId": player_id,
-                                                            "gameState": self.game_state})
-                if player_id == 1 and not self.game_state["gameStarted"]:
-                    self.initialize_game_map()
-                self.broadcast_game_state()
-                client_thread = threading.Thread(target=self.handle_client, args=(client_socket, client_id))
-                client_thread.daemon = True
-                client_thread.start()
+                # The handshake happens on its own thread so a slow client can't stall the listener
+                handshake_thread = threading.Thread(target=self.handle_handshake, args=(client_socket, address),
+                                                    name=f"handshake-{address[1]}")
+                handshake_thread.daemon = True
+                handshake_thread.start()
         except Exception as e:
             print(f"Error accepting connections: {e}")
         finally:
             self.shutdown_server()
 
-    def handle_client(self, client_socket, client_id):
+    def handle_handshake(self, client_socket, address):
+        # The client opens with a hello listing the compression modes it supports
+        reader = FrameReader(client_socket, MAX_CLIENT_FRAME_SIZE)
         try:
-            while True:
-                header = self.recvall(client_socket, 4)
-                if not header:
-                    break
-                message_length = int.from_bytes(header, byteorder='big')
-                data = self.recvall(client_socket, message_length)
-                if not data:
-                    break
-                message = json.loads(data.decode('utf-8'))
+            client_socket.settimeout(HANDSHAKE_TIMEOUT)
+            # Keep the generator alive until the hello is decoded; closing it releases the payload view
+            frames = reader.frames()
+            payload = next(frames, None)
+            hello = decode_message(payload) if payload is not None else None
+            frames.close()
+            client_socket.settimeout(None)
+        except Exception as e:
+            print(f"Handshake with {address} failed: {e}")
+            hello = None
+        if not hello or hello.get("type") != "hello":
+            print(f"No hello from {address}, closing")
+            client_socket.close()
+            return
+
+        connection = ClientConnection(next(self.client_ids), client_socket, address, reader)
+        if hello.get("role") == "spectator":
+            self.handle_spectator(connection, hello.get("matchId"))
+            return
+        name = hello.get("name")
+        if isinstance(name, str) and name.strip():
+            connection.name = name.strip()[:MAX_NAME_LENGTH]
+        if self.compression:
+            connection.compression_mode = choose_compression(hello.get("compression"))
+        # A dropped player presenting a valid resume token goes straight back into their match
+        token = hello.get("resumeToken")
+        if token:
+            match = next((m for m in list(self.matches.values()) if m.has_token(token)), None)
+            if match and match.resume_player(connection.client_id, connection, token):
+                self.metrics.incr("sessions.resumed")
+                self.serve(connection)
+                return
+            self.metrics.incr("sessions.resume_failed")
+            print(f"Resume token from {address} is unknown or expired; queueing as a new player")
+        # Queued connections hold no reader thread; the matchmaker starts a session once there is a slot
+        if not self.matchmaker.enqueue(connection):
+            try:
+                connection.send_message({"type": "connection_rejected", "message": "Server is full"})
+            except Exception:
+                pass
+            connection.close()
+
+    def handle_spectator(self, connection, match_id):
+        # Spectators skip the queue and take no player slot; without a matchId they watch the oldest match.
+        # Snapshots go out uncompressed so relays can forward the frames untouched.
+        matches = dict(self.matches)
+        if match_id is None and matches:
+            match_id = min(matches)
+        valid = match_id is None or (isinstance(match_id, int) and not isinstance(match_id, bool))
+        match = matches.get(match_id) if valid else None
+        if not valid:
+            reason = "matchId must be a match number"
+        elif match is None:
+            reason = "No match to spectate"
+        elif match.feed.subscribe(connection):
+            self.metrics.incr("spectators.subscribed")
+            return
+        else:
+            reason = "Spectator feed is full; connect through a relay"
+        self.metrics.incr("spectators.rejected")
+        try:
+            connection.send_message({"type": "connection_rejected", "message": reason})
+        except Exception:
+            pass
+        connection.close()
+
+    def find_open_match(self):
+        # Fill the fullest lobby first so matches reach their start threshold sooner
+        open_matches = [match for match in self.matches.values() if match.is_joinable()]
+        if open_matches:
+            return min(open_matches, key=lambda match: match.free_slots())
+        if len(self.matches) < self.max_matches:
+            match = Match(next(self.match_ids), self, self.interest_radius, self.match_settings)
+            self.matches[match.match_id] = match
+            print(f"Opened match {match.match_id}")
+            return match
+        return None
+
+    def map_pool(self, settings):
+        # One pool per arena size and player count, started on first use
+        with self.map_pools_lock:
+            pool = self.map_pools.get(settings.key())
+            if pool is None:
+                pool = self.map_pools[settings.key()] = MapPool(settings.map_spec, metrics=self.metrics)
+            return pool
+
+    def reap_matches(self):
+        for match_id, match in list(self.matches.items()):
+            if match.is_empty():
+                match.shutdown()
+                del self.matches[match_id]
+                print(f"Closed match {match_id}")
+        self.metrics.set_gauge("matches.active", len(self.matches))
+
+    def start_session(self, connection, match):
+        client_id = connection.client_id
+        try:
+            match.add_player(client_id, connection)
+        except Exception as e:
+            print(f"Could not admit client {client_id}: {e}")
+            connection.close()
+            return False
+        print(f"Client {client_id} joined match {match.match_id} as Player {connection.player_id}")
+        if connection.compression_mode:
+            print(f"Client {client_id} negotiated {connection.compression_mode} compression")
+        self.serve(connection)
+        return True
+
+    def serve(self, connection):
+        self.clients[connection.client_id] = connection
+        client_thread = threading.Thread(target=self.handle_client, args=(connection.client_id,),
+                                         name=f"client-{connection.client_id}")
+        client_thread.daemon = True
+        client_thread.start()
+
+    def handle_client(self, client_id):
+        connection = self.clients.get(client_id)
+        if connection is None:
+            return
+        reader = connection.reader
+        bucket = connection.input_bucket
+        try:
+            for payload in reader.frames():
+                message = decode_message(payload)
+                if message.get("type") not in UNLIMITED_MESSAGES and not bucket.allow():
+                    continue
                 print(f"Received from client {client_id}: {message}")
                 self.process_client_message(client_id, message)
         except Exception as e:
             print(f"Error with client {client_id}: {e}")
         finally:
+            self.metrics.incr("frames.received", reader.frames_read)
+            self.metrics.incr("frames.recv_calls", reader.recv_calls)
+            if bucket.dropped:
+                print(f"Client {client_id} exceeded the input rate; dropped {bucket.dropped} messages")
+                self.metrics.incr("input.dropped_rate_limited", bucket.dropped)
             self.handle_client_disconnect(client_id)
 
-    def recvall(self, sock, n):
-        data = b''
-        while len(data) < n:
-            packet = sock.recv(n - len(data))
-            if not packet:
-                return None
-            data += packet
-        return data
-
-    
     def process_client_message(self, client_id, message):
-        # Process the message from the client
-        msg_type = message.get("type")
-        # Get the player ID from the client
-        player_id = self.clients[client_id][2]
-        # Check if the player ID is valid
-        if msg_type == "move":
-            # Get the direction from the message
-            direction = message.get("direction")
-            # Check if the direction is valid
-            received_player_id = message.get("playerId")
-            # Check if the player ID matches
-            if received_player_id == player_id:
-                print(f"Processing move for Player {player_id}: {direction}")
-                # Initialize the move
-                self.move_player(player_id, direction)
-            # Unauthorized move attempt
-            else:
-                print(f"Player {player_id} tried to move Player {received_player_id} - unauthorized")
-        # Check if the message is to start the game
-        elif msg_type == "start_game" and player_id == 1:
-            print("Starting game by Player 1")
-            self.start_game()
-        # Check if the message is to click the red star
-        elif msg_type == "click_red_star":
-            received_player_id = message.get("playerId")
-            if received_player_id == player_id:
-                print(f"Player {player_id} clicked red star")
-                self.handle_red_star_click(player_id)
-
-    # In the GameServer class, update the handle_red_star_click method
-    def handle_red_star_click(self, player_id):
-        red_star = self.game_state["redStar"]
-        if not red_star["active"] or time.time() > red_star["expiresAt"]:
-            return
-
-        # Find the player
-        player = next((p for p in self.game_state["players"] if p["id"] == player_id), None)
-        if not player:
-            return
-
-        # Check if player's position is within range of the red star (more lenient)
-        # Calculate distance between player center and red star center
-        # player_center_x = player["x"] + PLAYER_SIZE / 2
-        # player_center_y = player["y"] + PLAYER_SIZE / 2
-        # star_center_x = red_star["x"] + RED_STAR_SIZE / 2
-        # star_center_y = red_star["y"] + RED_STAR_SIZE / 2
-
-        # # Use a more generous interaction range - player can click from a distance
-        # interaction_distance = PLAYER_SIZE + RED_STAR_SIZE * 5  # More lenient distance
-        # distance = ((player_center_x - star_center_x) ** 2 + (player_center_y - star_center_y) ** 2) ** 0.5
-
-        # if distance > interaction_distance:
-        #     print(f"Player {player_id} clicked but is too far from red star")
-        #     return
-
-        # Store player ID as string to ensure consistent dictionary key type
-        player_id_str = str(player_id)
-
-        # Update clicks for this player
-        if player_id_str not in red_star["clicksByPlayer"]:
-            red_star["clicksByPlayer"][player_id_str] = 0
-        red_star["clicksByPlayer"][player_id_str] += 1
-
-        print(
-            f"Player {player_id} clicked red star ({red_star['clicksByPlayer'][player_id_str]}/{RED_STAR_CLICKS_REQUIRED})")
-
-        # Check if this player has clicked enough times
-        if red_star["clicksByPlayer"][player_id_str] >= RED_STAR_CLICKS_REQUIRED:
-            print(f"Player {player_id} collected red star! +{RED_STAR_POINTS} points")
-            player["score"] += RED_STAR_POINTS
-            red_star["active"] = False
-            red_star["clicksByPlayer"] = {}
-            if self.red_star_timer:
-                self.red_star_timer.cancel()
-            self.schedule_red_star()
-
-        self.broadcast_game_state()
-
-    
-    def move_player(self, player_id, direction):
-        print(f"[Server] move_player() called for Player {player_id} direction: {direction}")
-
-        # check if game started - reject movement if not
-        if not self.game_state["gameStarted"]:
-            print("[Server] ❌ Move rejected: Game not started")
-            return
-
-        # find the player in the game state by their id 
-        player = next((p for p in self.game_state["players"] if p["id"] == player_id), None)
-        if not player:
-            print(f"[Server] ❌ Player {player_id} not found")
+        connection = self.clients.get(client_id)
+        if connection is None:
             return
-        #intialize movement delta
-        dx, dy = 0, 0
-        if direction == "up":
-            dy = -1
-        elif direction == "down":
-            dy = 1
-        elif direction == "left":
-            dx = -1
-        elif direction == "right":
-            dx = 1
-        else:
-            print(f"[Server] ❌ Invalid direction: {direction}")
-            return
-
-        current_time = time.time() * 1000
-        speed = player["speed"]
-        if player["powerups"]["speedBoost"] > current_time:
-            print(f"[Server] 🚀 Speed boost active for Player {player_id}")
-            speed += SPEED_BOOST
-        if player["powerups"]["speedPenalty"] > current_time:
-            print(f"[Server] 🐢 Speed penalty active for Player {player_id}")
-            speed = max(2, speed - SPEED_PENALTY)
-
-        new_x = player["x"] + dx * speed
-        new_y = player["y"] + dy * speed
-        new_x = max(0, min(CANVAS_SIZE - PLAYER_SIZE, new_x))
-        new_y = max(0, min(CANVAS_SIZE - PLAYER_SIZE, new_y))
-
-        # Collision with the obstacles
-        for obstacle in self.game_state["obstacles"]:
-            if self.check_collision(new_x, new_y, PLAYER_SIZE, obstacle["x"], obstacle["y"], obstacle["size"]):
-                print(f"[Server] ⛔ Collision with obstacle — reverting position")
-                new_x, new_y = player["x"], player["y"]
-                break
-
-        # Collision with other players
-        for other in self.game_state["players"]:
-            if other["id"] != player_id:
-                if self.check_collision(new_x, new_y, PLAYER_SIZE, other["x"], other["y"], PLAYER_SIZE):
-                    print(f"[Server] ⛔ Collision with another player — reverting position")
-                    new_x, new_y = player["x"], player["y"]
-                    break
-
-        # Powerup collection
-        for i, powerup in enumerate(self.game_state["powerups"]):
-            if powerup["active"] and self.check_collision(new_x, new_y, PLAYER_SIZE, powerup["x"], powerup["y"],
-                                                          POWERUP_SIZE):
-                self.game_state["powerups"][i]["active"] = False
-                if powerup["type"] == "speed":
-                    print(f"[Server] ⚡ Player {player_id} collected speed powerup")
-                    player["powerups"]["speedBoost"] = current_time + 8000
-                elif powerup["type"] == "slow":
-                    print(f"[Server] 🧊 Player {player_id} collected slow powerup")
-                    player["powerups"]["speedPenalty"] = current_time + 10000
-
-        # Shared object collection
-        shared_obj = self.game_state["sharedObject"]
-        if not shared_obj["isHeld"] and self.check_collision(new_x, new_y, PLAYER_SIZE, shared_obj["x"],
-                                                             shared_obj["y"], OBJECT_SIZE):
-            print(f"[Server] 🌟 Player {player_id} collected shared object")
-            valid_position = False
-            while not valid_position:
-                new_obj_x = random.randint(0, CANVAS_SIZE - OBJECT_SIZE)
-                new_obj_y = random.randint(0, CANVAS_SIZE - OBJECT_SIZE)
-                valid_position = True
-                for obstacle in self.game_state["obstacles"]:
-                    if self.check_collision(new_obj_x, new_obj_y, OBJECT_SIZE, obstacle["x"], obstacle["y"],
-                                            obstacle["size"]):
-                        valid_position = False
-                        break
-                if valid_position:
-                    for powerup in self.game_state["powerups"]:
-                        if powerup["active"] and self.check_collision(new_obj_x, new_obj_y, OBJECT_SIZE,
-                                                                      powerup["x"], powerup["y"], POWERUP_SIZE):
-                            valid_position = False
-                            break
-            shared_obj["x"] = new_obj_x
-            shared_obj["y"] = new_obj_y
-            player["score"] += 1
-            print(
-                f"[Server] 🎯 New object location: ({new_obj_x}, {new_obj_y}) — Player {player_id} score: {player['score']}")
-
-        old_x, old_y = player["x"], player["y"]
-        player["x"] = new_x
-        player["y"] = new_y
-        if old_x != new_x or old_y != new_y:
-            print(f"[Server] ✅ Player {player_id} moved from ({old_x}, {old_y}) → ({new_x}, {new_y})")
+        msg_type = message.get("type")
+        if msg_type == "get_metrics":
+            connection.send_message({"type": "metrics", "metrics": self.metrics_snapshot()})
+        elif msg_type == "pong":
+            if message.get("seq") != connection.ping_seq:
+                return  # Answer to an older ping; its clientTime is stale
+            rtt = connection.record_pong(message.get("serverTime", 0), message.get("clientTime", 0), time.time())
+            if rtt is not None:
+                self.metrics.observe("net.rtt_ms", rtt * 1000)
+        elif msg_type == "get_leaderboard":
+            players = self.history.leaderboard(query_limit(message)) if self.history else []
+            connection.send_message({"type": "leaderboard", "players": players})
+        elif msg_type == "get_history":
+            name = message.get("name") or connection.name
+            matches = self.history.player_history(name, query_limit(message)) \
+                if self.history and isinstance(name, str) else []
+            connection.send_message({"type": "player_history", "name": name, "matches": matches})
+        elif msg_type == "admin":
+            connection.send_message(self.handle_admin(client_id, message))
+        elif msg_type == "leave":
+            connection.match.remove_player(client_id)
         else:
-            print(f"[Server] ℹ️ Player {player_id} position unchanged")
-
-        # Always broadcast the updated game state
-        print(f"[Server] 📡 Broadcasting game state after move by Player {player_id}")
-        self.broadcast_game_state()
-
-    def check_collision(self, x1, y1, size1, x2, y2, size2):
-        return (x1 < x2 + size2 and x1 + size1 > x2 and y1 < y2 + size2 and y1 + size1 > y2)
-
-    def start_game(self):
-        for player in self.game_state["players"]:
-            for pos in STARTING_POSITIONS:
-                if pos["color"] == player["color"]:
-                    player["x"] = pos["x"]
-                    player["y"] = pos["y"]
-                    break
-            player["score"] = 0
-            player["powerups"]["speedBoost"] = 0
-            player["powerups"]["speedPenalty"] = 0
-        self.game_state["sharedObject"]["x"] = CANVAS_SIZE / 2 - OBJECT_SIZE / 2
-        self.game_state["sharedObject"]["y"] = CANVAS_SIZE / 2 - OBJECT_SIZE / 2
-        self.game_state["sharedObject"]["isHeld"] = False
-        self.game_state["sharedObject"]["holderId"] = None
-        self.game_state["obstacles"] = self.generate_obstacles()
-        self.game_state["powerups"] = self.generate_powerups()
-        self.game_state["timeRemaining"] = GAME_DURATION
-        self.game_state["gameStarted"] = True
-        self.game_state["winner"] = None
-        self.game_state["redStar"]["active"] = False
-        self.game_state["redStar"]["clicksByPlayer"] = {}
-
-        print("Game started")
-        self.broadcast_game_state()
-
-        if self.game_timer:
-            self.game_timer.cancel()
-        self.game_timer = threading.Timer(1.0, self.update_game_timer)
-        self.game_timer.daemon = True
-        self.game_timer.start()
-
-        # Schedule the first red star appearance
-        self.schedule_red_star()
-
-    def schedule_red_star(self):
-        if not self.game_state["gameStarted"]:
-            return
-
-        interval = random.randint(RED_STAR_MIN_INTERVAL, RED_STAR_MAX_INTERVAL)
-        print(f"[Server] Scheduling red star to appear in {interval} seconds")
-
-        if self.red_star_timer:
-            self.red_star_timer.cancel()
-
-        self.red_star_timer = threading.Timer(interval, self.spawn_red_star)
-        self.red_star_timer.daemon = True
-        self.red_star_timer.start()
-
-    def spawn_red_star(self):
-        if not self.game_state["gameStarted"]:
-            return
-
-        print("[Server] 🔴 Spawning red star")
-
-        valid_position = False
-        while not valid_position:
-            x = random.randint(0, CANVAS_SIZE - RED_STAR_SIZE)
-            y = random.randint(0, CANVAS_SIZE - RED_STAR_SIZE)
-
-            valid_position = True
-
-            # Check collision with obstacles
-            for obstacle in self.game_state["obstacles"]:
-                if self.check_collision(x, y, RED_STAR_SIZE, obstacle["x"], obstacle["y"], obstacle["size"]):
-                    valid_position = False
-                    break
+            connection.match.handle_message(client_id, message)
+
+    def handle_admin(self, client_id, message):
+        token = message.get("token")
+        if not ADMIN_TOKEN or not isinstance(token, str) or not hmac.compare_digest(token, ADMIN_TOKEN):
+            print(f"Client {client_id} sent an admin command without a valid token")
+            self.metrics.incr("admin.denied")
+            return {"type": "admin_result", "ok": False, "message": "Not authorized"}
+        command = message.get("command")
+        if command == "profile_start":
+            return {"type": "admin_result", "ok": self.profiler.start(), "command": command}
+        if command == "profile_stop":
+            summary = self.profiler.stop()
+            return {"type": "admin_result", "ok": summary is not None, "command": command, "profile": summary}
+        return {"type": "admin_result", "ok": False, "message": f"Unknown command {command}"}
 
-            # Check collision with powerups
-            if valid_position:
-                for powerup in self.game_state["powerups"]:
-                    if powerup["active"] and self.check_collision(x, y, RED_STAR_SIZE,
-                                                                  powerup["x"], powerup["y"], POWERUP_SIZE):
-                        valid_position = False
-                        break
-
-            # Check collision with shared object
-            if valid_position:
-                shared_obj = self.game_state["sharedObject"]
-                if self.check_collision(x, y, RED_STAR_SIZE, shared_obj["x"], shared_obj["y"], OBJECT_SIZE):
-                    valid_position = False
-
-        # Set red star properties
-        self.game_state["redStar"]["active"] = True
-        self.game_state["redStar"]["x"] = x
-        self.game_state["redStar"]["y"] = y
-        self.game_state["redStar"]["clicksByPlayer"] = {}
-        self.game_state["redStar"]["expiresAt"] = time.time() + RED_STAR_DURATION
-
-        # Broadcast the updated game state
-        self.broadcast_game_state()
-
-        # Schedule the red star to disappear
-        disappear_timer = threading.Timer(RED_STAR_DURATION, self.remove_red_star)
-        disappear_timer.daemon = True
-        disappear_timer.start()
-
-    def remove_red_star(self):
-        if self.game_state["redStar"]["active"]:
-            print("[Server] 🔴 Red star disappeared (timeout)")
-            self.game_state["redStar"]["active"] = False
-            self.game_state["redStar"]["clicksByPlayer"] = {}
-            self.broadcast_game_state()
-
-        # Schedule the next red star
-        self.schedule_red_star()
-
-    def update_game_timer(self):
-        if not self.game_state["gameStarted"]:
+    def handle_client_disconnect(self, client_id):
+        # Both the client thread and a failed broadcast may report the same disconnect
+        connection = self.clients.pop(client_id, None)
+        if connection is None:
             return
-        self.game_state["timeRemaining"] -= 1
-        current_time = time.time() * 1000
-        for player in self.game_state["players"]:
-            player["powerups"]["speedBoost"] = max(0, player["powerups"]["speedBoost"])
-            player["powerups"]["speedPenalty"] = max(0, player["powerups"]["speedPenalty"])
-        if self.game_state["timeRemaining"] <= 0:
-            self.end_game()
-        else:
-            self.game_timer = threading.Timer(1.0, self.update_game_timer)
-            self.game_timer.daemon = True
-            self.game_timer.start()
-            self.broadcast_game_state()
-
-    def end_game(self):
-        highest = -1
-        winner_id = None
-        for player in self.game_state["players"]:
-            if player["score"] > highest:
-                highest = player["score"]
-                winner_id = player["id"]
-        self.game_state["gameStarted"] = False
-        self.game_state["winner"] = winner_id
-
-        # Clear any active red star
-        self.game_state["redStar"]["active"] = False
-        if self.red_star_timer:
-            self.red_star_timer.cancel()
-
-        print(f"Game ended. Winner: Player {winner_id}")
-        self.broadcast_game_state()
-
-    def initialize_game_map(self):
-        self.game_state["obstacles"] = self.generate_obstacles()
-        self.game_state["powerups"] = self.generate_powerups()
-
-    def generate_obstacles(self):
-        obstacles = []
-        shared_obj = self.game_state["sharedObject"]
-        while len(obstacles) < NUM_OBSTACLES:
-            new_obstacle = {"x": random.uniform(0, CANVAS_SIZE - PLAYER_SIZE * 4),
-                            "y": random.uniform(0, CANVAS_SIZE - PLAYER_SIZE * 4), "size": PLAYER_SIZE * 2,
-                            "type": "ice"}
-            overlapping = False
-            for obs in obstacles:
-                if math.hypot(obs["x"] - new_obstacle["x"], obs["y"] - new_obstacle["y"]) < PLAYER_SIZE * 2.5:
-                    overlapping = True
-                    break
-            if overlapping:
-                continue
-            for player in self.game_state["players"]:
-                if math.hypot(player["x"] - new_obstacle["x"], player["y"] - new_obstacle["y"]) < PLAYER_SIZE * 4:
-                    overlapping = True
-                    break
-            if overlapping:
-                continue
-            if math.hypot(shared_obj["x"] - new_obstacle["x"], shared_obj["y"] - new_obstacle["y"]) < OBJECT_SIZE * 3:
-                continue
-            obstacles.append(new_obstacle)
-        return obstacles
-
-    def generate_powerups(self):
-        powerups = []
-        obstacles = self.game_state["obstacles"]
-        shared_obj = self.game_state["sharedObject"]
-        for _ in range(NUM_POWERUPS // 2):
-            while True:
-                x = random.uniform(0, CANVAS_SIZE - POWERUP_SIZE)
-                y = random.uniform(0, CANVAS_SIZE - POWERUP_SIZE)
-                if not any(math.hypot(p["x"] - x, p["y"] - y) < 30 * 5 for p in powerups) and \
-                        not any(self.check_collision(x, y, POWERUP_SIZE, obs["x"], obs["y"], obs["size"]) for obs in
-                                obstacles) and \
-                        math.hypot(shared_obj["x"] - x, shared_obj["y"] - y) >= OBJECT_SIZE * 5:
-                    powerups.append({"x": x, "y": y, "type": "speed", "active": True})
-                    break
-        for _ in range(NUM_POWERUPS // 2):
-            while True:
-                x = random.uniform(0, CANVAS_SIZE - POWERUP_SIZE)
-                y = random.uniform(0, CANVAS_SIZE - POWERUP_SIZE)
-                if not any(math.hypot(p["x"] - x, p["y"] - y) < 30 * 5 for p in powerups) and \
-                        not any(self.check_collision(x, y, POWERUP_SIZE, obs["x"], obs["y"], obs["size"]) for obs in
-                                obstacles) and \
-                        math.hypot(shared_obj["x"] - x, shared_obj["y"] - y) >= OBJECT_SIZE * 5:
-                    powerups.append({"x": x, "y": y, "type": "slow", "active": True})
-                    break
-        return powerups
-
-    def broadcast_game_state(self):
-        # Make a deep copy to prevent mutation
-        game_state_copy = json.loads(json.dumps(self.game_state))
-
-        message = {"type": "game_state_update", "gameState": game_state_copy}
-        for client_id, (client_socket, _, player_id) in list(self.clients.items()):
+        # The peer is gone or stalled; nothing queued for it is worth waiting on
+        connection.abort()
+        print(f"Client {client_id} (Player {connection.player_id}) disconnected")
+        compressor = connection.compressor
+        if compressor:
+            print(f"Client {client_id} {compressor.mode}: {compressor.raw_bytes} -> {compressor.compressed_bytes} bytes "
+                  f"(ratio {compressor.ratio():.2f}, {compressor.cpu_time * 1000:.1f} ms CPU)")
+            self.metrics.incr("compression.raw_bytes", compressor.raw_bytes)
+            self.metrics.incr("compression.compressed_bytes", compressor.compressed_bytes)
+            self.metrics.incr("compression.cpu_seconds", compressor.cpu_time)
+        # Unless the player sent leave, their slot is held so they can resume
+        connection.match.suspend_player(client_id)
+
+    def metrics_snapshot(self):
+        snapshot = self.metrics.snapshot()
+        counters = snapshot["counters"]
+        # Fold in the compression streams of connections that are still open
+        raw = counters.get("compression.raw_bytes", 0)
+        compressed = counters.get("compression.compressed_bytes", 0)
+        cpu = counters.get("compression.cpu_seconds", 0.0)
+        for connection in list(self.clients.values()):
+            if connection.compressor:
+                raw += connection.compressor.raw_bytes
+                compressed += connection.compressor.compressed_bytes
+                cpu += connection.compressor.cpu_time
+        # Likewise the frame and rate limit counters, which connections only add to the totals on disconnect
+        for connection in list(self.clients.values()):
+            counters["frames.received"] = counters.get("frames.received", 0) + connection.reader.frames_read
+            counters["frames.recv_calls"] = counters.get("frames.recv_calls", 0) + connection.reader.recv_calls
+            dropped = connection.input_bucket.dropped
+            if dropped:
+                counters["input.dropped_rate_limited"] = counters.get("input.dropped_rate_limited", 0) + dropped
+        snapshot["compression"] = {"rawBytes": raw, "compressedBytes": compressed, "cpuSeconds": cpu,
+                                   "ratio": raw / compressed if compressed else None,
+                                   "cpuMicrosPerKB": cpu * 1e6 / (raw / 1024) if raw else None}
+        snapshot["gauges"]["clients"] = len(self.clients)
+        snapshot["rtt"] = {str(connection.client_id): round(connection.rtt * 1000, 1)
+                           for connection in list(self.clients.values()) if connection.rtt is not None}
+        return snapshot
+
+    def ping_clients(self):
+        # Each ping carries what the last pong taught us, so the client can show its RTT
+        # and map server timestamps onto its own clock
+        for client_id, connection in list(self.clients.items()):
+            connection.ping_seq += 1
             try:
-                self.send_message_to_client(client_socket, message)
-                print(f"Broadcasted game state to Player {player_id}")
+                connection.send_message({"type": "ping", "seq": connection.ping_seq, "serverTime": time.time(),
+                                         "rtt": connection.rtt, "clockOffset": connection.clock_offset})
             except Exception as e:
-                print(f"Error sending to client {client_id}: {e}")
-                self.handle_client_disconnect(client_id)
-
-    def send_message_to_client(self, client_socket, message):
-        data = json.dumps(message).encode('utf-8')
-        length = len(data).to_bytes(4, byteorder='big')
-        client_socket.sendall(length + data)
-
-    def handle_client_disconnect(self, client_id):
-        if client_id in self.clients:
-            client_socket, _, player_id = self.clients[client_id]
-            try:
-                client_socket.close()
-            except:
-                pass
-            del self.clients[client_id]
-            print(f"Client {client_id} (Player {player_id}) disconnected")
-
-        self.game_state["players"] = [p for p in self.game_state["players"] if p["id"] != player_id]
-        if not self.game_state["players"] and self.game_state["gameStarted"]:
-            self.game_state["gameStarted"] = False
-            if self.game_timer:
-                self.game_timer.cancel()
-                self.game_timer = None
-            if self.red_star_timer:
-                self.red_star_timer.cancel()
-                self.red_star_timer = None
-        self.broadcast_game_state()
+                print(f"Error pinging client {client_id}: {e}")
 
     def game_loop(self):
         while True:
-            if self.game_state["gameStarted"]:
-                current_time = time.time() * 1000
-                for player in self.game_state["players"]:
-                    player["powerups"]["speedBoost"] = max(0, player["powerups"]["speedBoost"])
-                    player["powerups"]["speedPenalty"] = max(0, player["powerups"]["speedPenalty"])
-
-                # Check if red star has expired
-                if self.game_state["redStar"]["active"] and time.time() > self.game_state["redStar"]["expiresAt"]:
-                    self.remove_red_star()
-
-            time.sleep(0.01)
+            for match in list(self.matches.values()):
+                try:
+                    match.tick()
+                except Exception as e:
+                    print(f"Error ticking match {match.match_id}: {e}")
+            # Admits players into slots freed since the last tick and refreshes queue positions
+            self.matchmaker.pump()
+            if time.time() - self.last_ping_at >= PING_INTERVAL:
+                self.last_ping_at = time.time()
+                self.ping_clients()
+            time.sleep(TICK_INTERVAL)
 
 
 if __name__ == "__main__":
-    server = GameServer(host='0.0.0.0', port=5001)
+    parser = argparse.ArgumentParser(description="Capture The Star server")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--max-players", type=int, default=MAX_PLAYERS, help="players per match, up to 64")
+    parser.add_argument("--arena-size", type=int, default=None,
+                        help="arena edge in pixels; scales with --max-players by default")
+    parser.add_argument("--interest-radius", type=int, default=INTEREST_RADIUS,
+                        help="only send each player what is within this many pixels; everything by default")
+    args = parser.parse_args()
+    if args.interest_radius is not None and args.interest_radius <= 0:
+        parser.error("--interest-radius must be positive")
+    try:
+        match_settings = MatchSettings(args.max_players, args.arena_size)
+    except ValueError as e:
+        parser.error(str(e))
+    server = GameServer(host='0.0.0.0', port=args.port, interest_radius=args.interest_radius, settings=match_settings)
     try:
         server.start_server()
     except KeyboardInterrupt:
@@ -0,0 +1,161 @@
+# Shared-memory snapshot ring. Each match can write its encoded game_state_update
+# payloads into a file-backed mmap (put the directory on tmpfs, e.g. /dev/shm) so
+# analytics, replay recorders and relays on the same host read them without a
+# socket. Readers only ever read the mapping; the server never knows about them.
+#
+# Layout: a HEADER_SIZE header, then `slots` slots of `slot_size` bytes. Snapshot n
+# goes in slot n % slots. Each slot starts with a sequence word that is 2n - 1 while
+# snapshot n is being written and 2n once it is complete; a reader copies a slot and
+# then checks the word again, so a slot overwritten mid-read is detected and dropped.
+import mmap
+import os
+import struct
+import sys
+import time
+
+RING_SLOTS = 8  # Snapshots kept; a reader more than this far behind skips ahead
+RING_SLOT_SIZE = 128 * 1024  # Bytes per slot, slot header included; larger snapshots are not published
+RING_MAGIC = b"CTSRING\0"
+RING_VERSION = 1
+POLL_INTERVAL = 0.005  # Seconds a following reader sleeps when there is nothing new
+
+HEADER = struct.Struct("<8sIIIII")  # magic, version, slots, slot size, match id, closed
+LATEST = struct.Struct("<Q")  # Sequence number of the newest complete snapshot
+LATEST_OFFSET = 32
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct("<QI")  # sequence word, payload length
+SLOT_DATA_OFFSET = 16
+CLOSED_OFFSET = 24
+
+
+def ring_path(directory, match_id):
+    return os.path.join(directory, f"match-{match_id}.ring")
+
+
+class SnapshotRing:
+    # Writer side; one per match, only ever written under the match lock
+    def __init__(self, path, match_id, slots=RING_SLOTS, slot_size=RING_SLOT_SIZE, metrics=None):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.metrics = metrics
+        self.seq = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Build the file under a temporary name so readers never map a half-initialized ring
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w+b") as f:
+            f.truncate(HEADER_SIZE + slots * slot_size)
+            self.map = mmap.mmap(f.fileno(), 0)
+        HEADER.pack_into(self.map, 0, RING_MAGIC, RING_VERSION, slots, slot_size, match_id, 0)
+        os.replace(tmp_path, path)
+
+    def publish(self, payload):
+        length = len(payload)
+        if length > self.slot_size - SLOT_DATA_OFFSET:
+            print(f"Snapshot of {length} bytes does not fit a {self.slot_size} byte ring slot")
+            self.count("ring.oversize")
+            return
+        seq = self.seq + 1
+        offset = HEADER_SIZE + (seq % self.slots) * self.slot_size
+        SLOT_HEADER.pack_into(self.map, offset, 2 * seq - 1, length)
+        self.map[offset + SLOT_DATA_OFFSET:offset + SLOT_DATA_OFFSET + length] = payload
+        SLOT_HEADER.pack_into(self.map, offset, 2 * seq, length)
+        LATEST.pack_into(self.map, LATEST_OFFSET, seq)
+        self.seq = seq
+        self.count("ring.published")
+
+    def count(self, name):
+        if self.metrics:
+            self.metrics.incr(name)
+
+    def close(self):
+        # Readers still holding the mapping see the flag and stop
+        struct.pack_into("<I", self.map, CLOSED_OFFSET, 1)
+        self.map.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class SnapshotReader:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.slots, self.slot_size, self.match_id, _ = HEADER.unpack_from(self.map, 0)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            self.map.close()
+            raise ValueError(f"{path} is not a version {RING_VERSION} snapshot ring")
+        self.view = memoryview(self.map)
+        self.last_seq = max(0, self.latest_seq() - 1)  # Start from the newest snapshot
+        self.skipped = 0  # Snapshots overwritten before this reader got to them
+
+    def latest_seq(self):
+        return LATEST.unpack_from(self.map, LATEST_OFFSET)[0]
+
+    def is_closed(self):
+        return struct.unpack_from("<I", self.map, CLOSED_OFFSET)[0] == 1
+
+    def slot_view(self, seq):
+        # Zero-copy view of snapshot seq, or None if it is not in the ring. The writer may
+        # reuse the slot at any time: check still_valid(seq) after using the view.
+        offset = HEADER_SIZE + (seq % self.slots) * self.slot_size
+        word, length = SLOT_HEADER.unpack_from(self.map, offset)
+        if word != 2 * seq:
+            return None
+        return self.view[offset + SLOT_DATA_OFFSET:offset + SLOT_DATA_OFFSET + length]
+
+    def still_valid(self, seq):
+        offset = HEADER_SIZE + (seq % self.slots) * self.slot_size
+        return SLOT_HEADER.unpack_from(self.map, offset)[0] == 2 * seq
+
+    def read(self, seq):
+        # A private copy of snapshot seq, or None if it was overwritten
+        view = self.slot_view(seq)
+        if view is None:
+            return None
+        payload = bytes(view)
+        return payload if self.still_valid(seq) else None
+
+    def poll(self):
+        # Snapshots published since the last poll, oldest first, as (seq, payload)
+        latest = self.latest_seq()
+        first = max(self.last_seq + 1, latest - self.slots + 1)
+        self.skipped += max(0, first - self.last_seq - 1)
+        results = []
+        for seq in range(first, latest + 1):
+            payload = self.read(seq)
+            if payload is None:
+                self.skipped += 1
+            else:
+                results.append((seq, payload))
+        self.last_seq = max(self.last_seq, latest)
+        return results
+
+    def follow(self, poll_interval=POLL_INTERVAL):
+        while not self.is_closed():
+            snapshots = self.poll()
+            if not snapshots:
+                time.sleep(poll_interval)
+            for snapshot in snapshots:
+                yield snapshot
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+
+if __name__ == "__main__":
+    # Tails a ring: python snapshot_ring.py /dev/shm/capture-the-star/match-1.ring
+    from protocol import decode_message
+
+    reader = SnapshotReader(sys.argv[1])
+    print(f"Following match {reader.match_id} ({reader.slots} slots of {reader.slot_size} bytes)")
+    try:
+        for seq, payload in reader.follow():
+            state = decode_message(payload).get("gameState", {})
+            print(f"#{seq}: {len(payload)} bytes, {len(state.get('players', []))} players, "
+                  f"{state.get('timeRemaining')}s left, {reader.skipped} skipped")
+    except KeyboardInterrupt:
+        pass
+    reader.close()
@@ -0,0 +1,99 @@
+# Spectator feed of a match. The match publishes each full snapshot once, already
+# framed; every subscriber (normally a relay.py process, or a single viewer) gets
+# it from its own sender thread, so subscribers never slow down the match.
+import queue
+import threading
+
+from protocol import encode_frame, encode_message
+
+MAX_FEED_SUBSCRIBERS = 8  # Direct subscribers per match; fan out further through relays
+SUBSCRIBER_BACKLOG = 8  # Frames buffered per subscriber before the oldest are dropped
+
+
+def spectate_accepted_frame(match_id, relay=False):
+    return encode_frame(encode_message({"type": "spectate_accepted", "matchId": match_id, "relay": relay}))
+
+
+class FeedSubscriber:
+    def __init__(self, feed, connection):
+        self.feed = feed
+        self.connection = connection
+        self.frames = queue.Queue(maxsize=SUBSCRIBER_BACKLOG)
+        self.thread = threading.Thread(target=self.run, name=f"spectator-{connection.client_id}")
+        self.thread.daemon = True
+
+    def offer(self, frame):
+        # Every frame is a full snapshot, so a lagging subscriber can safely skip old ones
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.feed.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is None:
+                    break
+                with self.connection.send_lock:
+                    self.connection.socket.sendall(frame)
+        except OSError as e:
+            print(f"Spectator {self.connection.address} dropped: {e}")
+        finally:
+            self.feed.unsubscribe(self)
+            self.connection.close()
+
+    def stop(self):
+        self.offer(None)
+
+
+class SnapshotFeed:
+    def __init__(self, match_id):
+        self.match_id = match_id
+        self.subscribers = []
+        self.latest = None  # Last frame, sent first to new subscribers
+        self.published = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def has_subscribers(self):
+        return bool(self.subscribers)
+
+    def subscribe(self, connection):
+        with self.lock:
+            if len(self.subscribers) >= MAX_FEED_SUBSCRIBERS:
+                return False
+            subscriber = FeedSubscriber(self, connection)
+            subscriber.offer(spectate_accepted_frame(self.match_id))
+            if self.latest:
+                subscriber.offer(self.latest)
+            self.subscribers.append(subscriber)
+        subscriber.thread.start()
+        print(f"Spectator {connection.address} subscribed to match {self.match_id}")
+        return True
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, payload):
+        # payload is an encoded game_state_update; frame it once for everyone
+        frame = encode_frame(payload)
+        with self.lock:
+            self.latest = frame
+            self.published += 1
+            for subscriber in self.subscribers:
+                subscriber.offer(frame)
+
+    def close(self):
+        with self.lock:
+            subscribers, self.subscribers = self.subscribers, []
+        for subscriber in subscribers:
+            subscriber.stop()
@@ -0,0 +1,108 @@
+# Sprite atlas for the client. Every icon is drawn once into a single image
+# that is cached on disk, so later launches load one PNG instead of drawing
+# the polygons again. The cache file name carries a hash of everything that
+# affects the pixels; changing a size, colour or ATLAS_VERSION rebuilds it.
+import hashlib
+import os
+import time
+
+import pygame
+
+ATLAS_VERSION = 1  # Bump when a draw_* function changes
+CACHE_DIR = os.environ.get("GAME_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "capture-the-star"))
+
+YELLOW = (255, 215, 0)
+YELLOW_SPEED = (255, 255, 0)
+BLUE_SLOW = (30, 144, 255)
+WHITE = (255, 255, 255)
+RED = (255, 0, 0)
+BRIGHT_RED = (255, 50, 50)
+
+
+def star_points(size):
+    return [(size / 2, 0), (size * 0.65, size * 0.35), (size, size * 0.4), (size * 0.75, size * 0.65),
+            (size * 0.8, size), (size / 2, size * 0.85), (size * 0.2, size), (size * 0.25, size * 0.65),
+            (0, size * 0.4), (size * 0.35, size * 0.35)]
+
+
+def draw_star(surface, size):
+    pygame.draw.polygon(surface, YELLOW, star_points(size))
+
+
+def draw_red_star(surface, size):
+    pygame.draw.polygon(surface, RED, star_points(size))
+    # Add a glowing effect (pulsating outline)
+    pygame.draw.polygon(surface, BRIGHT_RED, star_points(size), 2)
+
+
+def draw_speed(surface, size):
+    pygame.draw.polygon(surface, YELLOW_SPEED, [
+        (size / 2, 0), (size * 0.25, size * 0.5), (size * 0.6, size * 0.5), (size * 0.4, size),
+        (size * 0.75, size * 0.5), (size * 0.4, size * 0.5), (size * 0.6, 0)
+    ])
+
+
+def draw_slow(surface, size):
+    pygame.draw.circle(surface, BLUE_SLOW, (size // 2, size // 2), size // 2)
+    pygame.draw.line(surface, WHITE, (size // 2, 2), (size // 2, size - 2), 2)
+    pygame.draw.line(surface, WHITE, (2, size // 2), (size - 2, size // 2), 2)
+    pygame.draw.line(surface, WHITE, (size * 0.25, size * 0.25), (size * 0.75, size * 0.75), 2)
+    pygame.draw.line(surface, WHITE, (size * 0.25, size * 0.75), (size * 0.75, size * 0.25), 2)
+
+
+DRAWERS = {"star": draw_star, "red_star": draw_red_star, "speed": draw_speed, "slow": draw_slow}
+
+
+def atlas_key(sizes):
+    spec = repr((ATLAS_VERSION, sorted(sizes.items()), YELLOW, YELLOW_SPEED, BLUE_SLOW, WHITE, RED, BRIGHT_RED))
+    return hashlib.sha1(spec.encode()).hexdigest()[:12]
+
+
+def layout(sizes):
+    # Icons side by side in name order, each in its own size x size cell
+    rects = {}
+    x = 0
+    for name in sorted(sizes):
+        rects[name] = pygame.Rect(x, 0, sizes[name], sizes[name])
+        x += sizes[name]
+    return rects, (max(x, 1), max(sizes.values(), default=1))
+
+
+def build_atlas(sizes):
+    rects, atlas_size = layout(sizes)
+    atlas = pygame.Surface(atlas_size, pygame.SRCALPHA)
+    for name, rect in rects.items():
+        icon = pygame.Surface(rect.size, pygame.SRCALPHA)
+        DRAWERS[name](icon, rect.width)
+        atlas.blit(icon, rect.topleft)
+    return atlas
+
+
+def load_atlas(sizes, cache_dir=CACHE_DIR):
+    # sizes: sprite name -> edge length in pixels. Returns ({name: Surface}, stats)
+    start = time.perf_counter()
+    rects, _ = layout(sizes)
+    path = os.path.join(cache_dir, f"atlas-{atlas_key(sizes)}.png")
+    atlas = None
+    source = "cache"
+    if os.path.exists(path):
+        try:
+            atlas = pygame.image.load(path)
+        except Exception as e:
+            print(f"Ignoring unreadable sprite cache {path}: {e}")
+    if atlas is None:
+        source = "built"
+        atlas = build_atlas(sizes)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write then rename so a concurrent launch never reads half a file
+            tmp_path = f"{path}.{os.getpid()}.tmp.png"
+            pygame.image.save(atlas, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Could not cache sprite atlas: {e}")
+    # Match the display's pixel format once, instead of converting on every blit
+    if pygame.display.get_surface() is not None:
+        atlas = atlas.convert_alpha()
+    sprites = {name: atlas.subsurface(rect) for name, rect in rects.items()}
+    return sprites, {"source": source, "path": path, "ms": (time.perf_counter() - start) * 1000}